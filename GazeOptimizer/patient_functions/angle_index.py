@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import math
+from typing import List, Tuple
+import numpy as np
+
+#default tolerance (degrees) for matching angles, e.g. angles coming back from plot clicks
+ANGLE_TOL = 1e-3
+
+
+class AngleIndex:
+    """
+    Hash index of gaze angles (polar, azimuthal in degrees) for constant time lookup.
+
+    Angles are hashed to cells of a grid with spacing `tol`, a query checks its own cell and
+    the eight neighbouring ones, so every angle within `tol` of the query is found no matter
+    on which side of a cell border it lies. Azimuthal angles wrap around at 360°.
+    """
+    def __init__(
+        self,
+        polar: np.ndarray,
+        azimuthal: np.ndarray,
+        tol: float=ANGLE_TOL
+        ):
+        """
+        Parameters:
+        polar (np.ndarray): Polar angle of every gaze angle (degrees).
+        azimuthal (np.ndarray): Azimuthal angle of every gaze angle (degrees).
+        tol (float): Maximum distance (degrees) of a query to a matching gaze angle, per angle.
+        """
+        self.polar = np.asarray(polar, dtype=float)
+        self.azimuthal = np.asarray(azimuthal, dtype=float) % 360
+        self.tol = tol
+        self.n_cells_azimuthal = int(np.ceil(360 / tol))
+
+        #plain floats, queries are single clicks
+        self.polar_list = self.polar.tolist()
+        self.azimuthal_list = self.azimuthal.tolist()
+        self.cells = {}
+        for i, (polar, azimuthal) in enumerate(zip(self.polar_list, self.azimuthal_list)):
+            self.cells.setdefault(self.cell(polar, azimuthal), []).append(i)
+
+    def __str__(self):
+        return f'AngleIndex of {len(self)} gaze angles, tolerance {self.tol}°'
+
+    def __len__(self):
+        return len(self.polar)
+
+    def cell(self, polar: float, azimuthal: float) -> Tuple[int]:
+        """
+        Grid cell of an angle (degrees).
+        """
+        return math.floor(polar / self.tol), math.floor((azimuthal % 360) / self.tol) % self.n_cells_azimuthal
+
+    def find(self, polar: float, azimuthal: float) -> int:
+        """
+        Index of the gaze angle closest to (polar, azimuthal) within the tolerance, None if there is none.
+        """
+        p, a = self.cell(polar, azimuthal)
+        azimuthal = azimuthal % 360
+        best, best_distance = None, math.inf
+        for dp in (-1, 0, 1):
+            for da in (-1, 0, 1):
+                for i in self.cells.get((p + dp, (a + da) % self.n_cells_azimuthal), []):
+                    d_polar = abs(self.polar_list[i] - polar)
+                    d_azimuthal = abs(self.azimuthal_list[i] - azimuthal)
+                    d_azimuthal = min(d_azimuthal, 360 - d_azimuthal)
+                    if d_polar <= self.tol and d_azimuthal <= self.tol and math.hypot(d_polar, d_azimuthal) < best_distance:
+                        best, best_distance = i, math.hypot(d_polar, d_azimuthal)
+        return best
+
+
+def angle_plan_ids(angle_idx: np.ndarray, n_angles: int) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Plans of every gaze angle.
+    Parameters:
+    angle_idx (np.ndarray): Gaze angle index of the first two beams of every plan (plans x 2),
+        -1 for a missing second beam, see `PlanSet.beams`.
+    n_angles (int): Number of gaze angles.
+    Returns:
+    Tuple[np.ndarray, List[np.ndarray]]: Single beam plan ID of every gaze angle (-1 if it has none)
+        and the IDs of all plans with a beam at every gaze angle, single and two beam plans.
+    """
+    single = np.full(n_angles, -1, dtype=int)
+    plan_ids = np.flatnonzero(angle_idx[:, 1] < 0)
+    single[angle_idx[plan_ids, 0]] = plan_ids
+
+    #(angle, plan) pairs of both beams, a plan with both beams at one angle counts once
+    angles = angle_idx.ravel()
+    plan_ids = np.repeat(np.arange(len(angle_idx)), angle_idx.shape[1])
+    keep = angles >= 0
+    codes = np.unique(angles[keep] * len(angle_idx) + plan_ids[keep])
+    starts = np.searchsorted(codes, np.arange(n_angles + 1) * len(angle_idx))
+    members = [codes[start:stop] % len(angle_idx) for start, stop in zip(starts[:-1], starts[1:])]
+    return single, members
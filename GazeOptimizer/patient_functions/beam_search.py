@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+import numpy as np
+
+from GazeOptimizer.patient_functions.combination import TwoBeamCombiner, combine_beams, simplex_weights
+from GazeOptimizer.patient_functions.patient import TreatmentPlan, build_beam_plans
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+
+
+class BeamSearch:
+    """
+    Branch-and-bound search for the best plan with up to `max_beams` gaze angles.
+
+    Beam weights of a set of k angles are the positive multiples of 1/n_steps summing to one.
+    Angle sets are enumerated depth first, angles ordered by their single beam cost, and every
+    set is extended by angles further down that order only.
+
+    The weight vectors of a set are split into cells of `cell_size` neighbouring vectors. The
+    voxel-wise minimum of the doses of a cell is below the dose of each of its plans. All metrics
+    of the cost model (Dx, Vx, DVH area) grow with the voxel doses and the cost weights are
+    non-negative, so the cost of this dose is a lower bound of every plan of the cell. Cells whose
+    bound is not below the best cost found so far are pruned without building their plans.
+    The bound is exact for fixed DVH bin edges (`dvh_edges`), with per-plan edges it holds up to the binning.
+
+    Angle sets themselves are not bounded: a bound of all plans of a set, or of all sets extending
+    it, takes the minimum over doses of far apart weights or angles. Mixing beams lowers the cost
+    below every single beam, so such a bound stays far below the incumbent and never prunes.
+    """
+    def __init__(
+        self,
+        patient,
+        max_beams: int=3,
+        n_steps: int=10,
+        max_evals: int=10000,
+        cell_size: int=2,
+        combiner: TwoBeamCombiner=None
+        ):
+        """
+        Parameters:
+        patient (Patient): Patient to search plans for.
+        max_beams (int): Maximum number of beams per plan.
+        n_steps (int): Beam weights are multiples of 1/n_steps.
+        max_evals (int): Budget of cost evaluations, plans and lower bounds.
+        cell_size (int): Weight vectors per lower bound, 1 evaluates every plan without bounds.
+        combiner (TwoBeamCombiner, optional): Combiner to reuse, created if not given.
+        """
+        cost_model = patient.cost_model
+        if np.any(cost_model.metric_weights < 0) or np.any(cost_model.volume_weights < 0):
+            raise ValueError("Lower bounds require non-negative cost weights.")
+        if max_beams < 1 or max_beams > n_steps:
+            raise ValueError(f"max_beams must be between 1 and n_steps ({n_steps}), not {max_beams}.")
+        if cell_size < 1:
+            raise ValueError(f"cell_size must be at least 1, not {cell_size}.")
+
+        self.patient = patient
+        self.max_beams = max_beams
+        self.n_steps = n_steps
+        self.max_evals = max_evals
+        self.cell_size = cell_size
+        self.combiner = combiner if combiner is not None else TwoBeamCombiner(patient)
+        self.weights = {k: simplex_weights(k, n_steps) for k in range(1, max_beams+1)}
+
+        self.n_evals = 0
+        self.n_pruned = 0
+        self.best_plan = None
+        self.best_cost = np.inf
+
+    def __str__(self):
+        return f'BeamSearch up to {self.max_beams} beams, {self.n_evals}/{self.max_evals} evaluations, {self.n_pruned} cells pruned, best cost {self.best_cost}'
+
+    @property
+    def exhausted(self):
+        return self.n_evals >= self.max_evals
+
+    def evaluate(self, plans: List[TreatmentPlan]) -> np.ndarray:
+        """
+        Cost of plans, counted against the budget. Keeps track of the best plan.
+        """
+        costs, _ = self.patient.cost_model.evaluate(PlanSet(plans))
+        self.n_evals += len(plans)
+        i = int(np.argmin(costs))
+        if costs[i] < self.best_cost:
+            self.best_cost, self.best_plan = costs[i], plans[i]
+        return costs
+
+    def lower_bounds(
+        self,
+        idx: np.ndarray,
+        weights: np.ndarray,
+        starts: np.ndarray
+        ) -> np.ndarray:
+        """
+        Lower bound of the cost of every cell of plans, counted against the budget.
+        Parameters:
+        idx, weights (np.ndarray): Beam angle indices and weights of the plans (both plans x beams), ordered by cell.
+        starts (np.ndarray): First plan of every cell.
+        Returns:
+        np.ndarray: Cost of the voxel-wise minimum dose of the plans of every cell.
+        """
+        doses = combine_beams(self.combiner.angle_doses, idx, weights)
+        dvh_dose, dvh_volume = self.patient.dvh_engine.compute(np.minimum.reduceat(doses, starts, axis=0), gathered=True)
+        bound_plans = [
+            TreatmentPlan(patient=self.patient, angle_key='bound', dvh_dose=dvh_dose[i], dvh_volume=dvh_volume[i])
+            for i in range(len(starts))
+        ]
+        costs, _ = self.patient.cost_model.evaluate(PlanSet(bound_plans))
+        self.n_evals += len(starts)
+        return costs
+
+    def run(self) -> Tuple[TreatmentPlan, float, int]:
+        """
+        Search until all cells are evaluated or pruned or the budget is used up.
+        The number of pruned cells is kept in `n_pruned`.
+        Returns:
+        Tuple[TreatmentPlan, float, int]: Best plan, its cost and the number of cost evaluations.
+        """
+        n_angles = len(self.combiner.angle_keys)
+        singles = build_beam_plans(
+            patient=self.patient,
+            idx=np.arange(n_angles)[:, None],
+            weights=np.ones((n_angles, 1)),
+            combiner=self.combiner
+        )
+        order = np.argsort(self.evaluate(singles), kind='stable')
+
+        #nodes are positions in `order`, children append positions after the last one
+        stack = [(p,) for p in reversed(range(n_angles))] if self.max_beams > 1 else []
+        while stack and not self.exhausted:
+            node = stack.pop()
+            if len(node) > 1:
+                self.evaluate_node(order[list(node)])
+            if len(node) < self.max_beams:
+                stack += [node + (p,) for p in reversed(range(node[-1]+1, n_angles))]
+
+        return self.best_plan, self.best_cost, self.n_evals
+
+    def evaluate_node(self, angle_idx: np.ndarray):
+        """
+        Evaluate all beam weights of a set of gaze angles, as far as the budget allows. 
+        Cells are bounded in chunks of the combiner's size, every chunk against the best cost so far.
+        """
+        weights = self.weights[len(angle_idx)]
+        idx = np.broadcast_to(angle_idx, weights.shape)
+        step = max(1, self.combiner.rows_per_chunk // self.cell_size) * self.cell_size
+        for start in range(0, len(weights), step):
+            if self.exhausted:
+                return
+            rows = slice(start, start+step)
+            self.evaluate_cells(idx[rows], weights[rows])
+
+    def evaluate_cells(
+        self,
+        idx: np.ndarray,
+        weights: np.ndarray
+        ):
+        """
+        Evaluate the plans of all cells whose lower bound is below the best cost. Cells of a single
+        plan are evaluated without a bound, the bound would cost as much as the plan.
+        """
+        cells = np.arange(len(weights)) // self.cell_size
+        sizes = np.bincount(cells)
+        bounded = np.flatnonzero(sizes > 1)[:self.max_evals - self.n_evals]
+        if len(bounded) > 0:
+            in_bounded = np.isin(cells, bounded)
+            starts = np.searchsorted(cells[in_bounded], bounded)
+            pruned = bounded[self.lower_bounds(idx[in_bounded], weights[in_bounded], starts) >= self.best_cost]
+            self.n_pruned += len(pruned)
+            keep = ~np.isin(cells, pruned)
+            idx, weights = idx[keep], weights[keep]
+
+        n_plans = min(len(weights), self.max_evals - self.n_evals)
+        if n_plans > 0:
+            self.evaluate(build_beam_plans(
+                patient=self.patient,
+                idx=idx[:n_plans],
+                weights=weights[:n_plans],
+                combiner=self.combiner
+            ))
+
+
+def search_beam_combinations(
+    patient,
+    max_beams: int=3,
+    n_steps: int=10,
+    max_evals: int=10000,
+    cell_size: int=2,
+    combiner: TwoBeamCombiner=None
+    ) -> Tuple[TreatmentPlan, float, int]:
+    """
+    Best plan with up to `max_beams` gaze angles, see `BeamSearch`.
+    Returns:
+    Tuple[TreatmentPlan, float, int]: Best plan, its cost and the number of cost evaluations.
+    """
+    search = BeamSearch(
+        patient=patient,
+        max_beams=max_beams,
+        n_steps=n_steps,
+        max_evals=max_evals,
+        cell_size=cell_size,
+        combiner=combiner
+    )
+    return search.run()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+import numpy as np
+
+
+class CostModel:
+    """
+    Cost function compiled from `Weights` into arrays.
+
+    Every weight becomes a metric term `weight * metric` (metric type, threshold and
+    ROI index are stored as arrays), followed by one volume term summing the area
+    under the DVH of every ROI, weighted by the ROI's weight. `evaluate` scores all
+    plans of a `PlanSet` at once.
+    """
+    def __init__(
+        self,
+        weights,
+        roi_names: List[str]
+        ):
+        """
+        Parameters:
+        weights (Weights): Weighted metrics of the cost function.
+        roi_names (List[str]): ROIs of the patient, each contributes to the volume term.
+        """
+        self.roi_names = list(roi_names)
+        self.term_names = [weight.metric.name for weight in weights] + ['Volume Term']
+        self.metric_types = np.array([weight.metric.metric_type for weight in weights])
+        self.thresholds = np.array([float(weight.metric.metric_value) for weight in weights])
+        self.roi_index = np.array([self.roi_names.index(weight.metric.roi_name) for weight in weights], dtype=int)
+        self.metric_weights = np.array([float(weight.value) for weight in weights])
+        self.volume_weights = np.array([float(weights.weight_for_roi(roi)) for roi in self.roi_names])
+
+    def __str__(self):
+        return ' + '.join([f'{w}*{name}' for w, name in zip(self.metric_weights, self.term_names)]) + ' + Volume Term'
+
+    def __len__(self):
+        return len(self.term_names)
+
+    def metric_matrix(self, plan_set) -> np.ndarray:
+        """
+        Unweighted metric value of every metric term for every plan (plans x metric terms).
+        """
+        metrics = np.empty((len(plan_set), len(self.metric_weights)))
+        for k, (metric_type, threshold, roi_idx) in enumerate(zip(self.metric_types, self.thresholds, self.roi_index)):
+            metrics[:, k] = plan_set.metric(
+                roi=self.roi_names[roi_idx],
+                metric_type=metric_type,
+                metric_value=threshold
+            )
+        return metrics
+
+    def auc_matrix(self, plan_set) -> np.ndarray:
+        """
+        Area under the DVH of every ROI for every plan (plans x ROIs).
+        """
+        return np.stack([plan_set.auc(roi) for roi in self.roi_names], axis=1)
+
+    def evaluate(self, plan_set) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cost of all plans of a plan set.
+        Parameters:
+        plan_set (PlanSet): Plans to score.
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: Cost per plan and contribution of every term (plans x terms),
+        columns ordered like `term_names`. Memoized on the plan set.
+        """
+        return plan_set.memo.get_or_compute(('cost', self), lambda: self._evaluate(plan_set))
+
+    def _evaluate(self, plan_set):
+        contributions = np.empty((len(plan_set), len(self.term_names)))
+        contributions[:, :-1] = self.metric_matrix(plan_set) * self.metric_weights[None, :]
+        contributions[:, -1] = self.auc_matrix(plan_set) / 100 @ self.volume_weights
+        return contributions.sum(axis=1), contributions
+
+    def contributions_dict(self, contributions: np.ndarray) -> Dict[str, float]:
+        """
+        Contributions of a single plan (one row of `evaluate`) by term name.
+        """
+        return dict(zip(self.term_names, contributions))
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Tuple
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets downsampling of many curves at once.
+
+    The first and last point are kept, the points in between are split into n_out-2 buckets
+    and from every bucket the point spanning the largest triangle with the point kept from
+    the previous bucket and the mean of the next bucket is kept. Buckets are processed in
+    order, every step is vectorized over all curves.
+    Parameters:
+    x (np.ndarray): x coordinates (rows x n), or (1 x n) if shared by all rows.
+    y (np.ndarray): y coordinates (rows x n).
+    n_out (int): Number of points to keep per curve, at least 3.
+    Returns:
+    np.ndarray: Ascending indices of the kept points (rows x n_out), all points if n_out >= n.
+    """
+    n_rows, n = y.shape
+    if n_out >= n:
+        return np.broadcast_to(np.arange(n), (n_rows, n))
+    if n_out < 3:
+        raise ValueError(f"n_out must be at least 3, not {n_out}.")
+
+    x = np.broadcast_to(x, y.shape)
+    rows = np.arange(n_rows)
+    edges = np.linspace(1, n-1, n_out-1).astype(int)
+
+    idx = np.empty((n_rows, n_out), dtype=np.intp)
+    idx[:, 0], idx[:, -1] = 0, n-1
+    for b in range(n_out-2):
+        lo, hi = edges[b], edges[b+1]
+
+        #mean of the next bucket, the last point for the last bucket
+        if b < n_out-3:
+            next_x = x[:, hi:edges[b+2]].mean(axis=1)
+            next_y = y[:, hi:edges[b+2]].mean(axis=1)
+        else:
+            next_x, next_y = x[:, -1], y[:, -1]
+
+        prev = idx[:, b]
+        prev_x, prev_y = x[rows, prev], y[rows, prev]
+        area = np.abs(
+            (prev_x - next_x)[:, None] * (y[:, lo:hi] - prev_y[:, None])
+            - (prev_x[:, None] - x[:, lo:hi]) * (next_y - prev_y)[:, None]
+        )
+        idx[:, b+1] = lo + np.argmax(area, axis=1)
+    return idx
+
+def decimate(x: np.ndarray, y: np.ndarray, n_out: int) -> Tuple[np.ndarray]:
+    """
+    Downsample many curves to n_out points each, see `lttb_indices`.
+    Returns:
+    Tuple[np.ndarray]: x and y of the kept points (rows x n_out).
+    """
+    x = np.broadcast_to(x, y.shape)
+    idx = lttb_indices(x, y, n_out)
+    return np.take_along_axis(x, idx, axis=1), np.take_along_axis(y, idx, axis=1)
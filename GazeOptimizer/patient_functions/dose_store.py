@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+from typing import Dict, List
+import h5py
+import numpy as np
+
+
+class ROIDoseStore:
+    """
+    Compact per-patient dose store.
+
+    Holds only the doses of voxels in the union of all ROI masks, one contiguous
+    row per gaze angle (angles x roi voxels), so memory and I/O scale with the size
+    of the eye structures instead of the CT dose grid. ROI voxels are addressed by
+    `gather_index`, ROI i occupies [roi_offsets[i], roi_offsets[i+1]) of it.
+
+    Rows are either given up front or read lazily from `h5_file_path` the first
+    time they are needed. Each row is read at most once.
+    """
+    def __init__(
+        self,
+        angle_keys: List[str],
+        voxel_index: np.ndarray,
+        roi_names: List[str],
+        roi_masks: Dict[str, np.ndarray],
+        roi_relative_values: Dict[str, np.ndarray],
+        voxel_vol: float,
+        doses: np.ndarray=None,
+        h5_file_path: str=None,
+        ):
+        """
+        Parameters:
+        angle_keys (List[str]): Gaze angle key of each dose row.
+        voxel_index (np.ndarray): Sorted dose grid indices of the stored voxels.
+        roi_names (List[str]): ROIs covered by the store.
+        roi_masks (dict): Dose grid indices of each ROI.
+        roi_relative_values (dict): Relative volume of each ROI voxel.
+        voxel_vol (float): Volume of a single dose grid voxel.
+        doses (np.ndarray, optional): Doses of the stored voxels (angles x voxels).
+        h5_file_path (str, optional): Patient h5 file to read rows from if `doses` is not given.
+        """
+        if doses is None and h5_file_path is None:
+            raise ValueError("Either doses or h5_file_path have to be specified.")
+        self.angle_keys = list(angle_keys)
+        self.angle_index = {angle_key: i for i, angle_key in enumerate(self.angle_keys)}
+        self.voxel_index = np.asarray(voxel_index)
+        self.roi_names = list(roi_names)
+        self.voxel_vol = voxel_vol
+        self.h5_file_path = h5_file_path
+
+        self._doses = None if doses is None else np.ascontiguousarray(doses)
+        self.loaded = np.full(len(self.angle_keys), doses is not None)
+
+        #positions of the ROI voxels within the store, concatenated over all ROIs
+        roi_sizes = np.array([len(roi_masks[roi]) for roi in self.roi_names])
+        self.roi_offsets = np.concatenate([[0], np.cumsum(roi_sizes)])
+        self.gather_index = np.searchsorted(
+            self.voxel_index,
+            np.concatenate([np.asarray(roi_masks[roi]) for roi in self.roi_names])
+        )
+        self.relative_volumes = np.concatenate([roi_relative_values[roi] for roi in self.roi_names])
+
+    def __str__(self):
+        return f'ROIDoseStore with {len(self.angle_keys)} gaze angles ({self.loaded.sum()} loaded) and {self.n_voxels} ROI voxels'
+
+    def __len__(self):
+        return len(self.angle_keys)
+
+    @property
+    def n_voxels(self):
+        return len(self.voxel_index)
+
+    @property
+    def doses(self):
+        """All dose rows (angles x voxels), missing rows are read first."""
+        self.load(self.angle_keys)
+        return self._doses
+
+    @property
+    def roi_masks(self):
+        """Positions of each ROI's voxels within a store dose row."""
+        return {roi: self.gather_index[self.roi_offsets[i]:self.roi_offsets[i+1]] for i, roi in enumerate(self.roi_names)}
+
+    @property
+    def roi_relative_values(self):
+        """Relative volume of each ROI's voxels."""
+        return {roi: self.relative_volumes[self.roi_offsets[i]:self.roi_offsets[i+1]] for i, roi in enumerate(self.roi_names)}
+
+    def nbytes(self) -> int:
+        """Memory of the dose rows, allocated for all angles once the first row is read."""
+        return 0 if self._doses is None else self._doses.nbytes
+
+    def load(self, angle_keys: List[str]):
+        """
+        Read the dose rows of gaze angles that are not loaded yet.
+        """
+        missing = [self.angle_index[angle_key] for angle_key in angle_keys if not self.loaded[self.angle_index[angle_key]]]
+        if len(missing) == 0:
+            return
+        with h5py.File(self.h5_file_path, "r") as h5_file:
+            rows = read_dose_rows(h5_file, [self.angle_keys[i] for i in missing], self.voxel_index)
+        if self._doses is None:
+            self._doses = np.empty((len(self.angle_keys), self.n_voxels), dtype=rows.dtype)
+        self._doses[missing] = rows
+        self.loaded[missing] = True
+
+    def dose(self, angle_key: str) -> np.ndarray:
+        """Store dose row of a single gaze angle."""
+        self.load([angle_key])
+        return self._doses[self.angle_index[angle_key]]
+
+
+def read_dose_rows(
+    h5_file,
+    angle_keys: List[str],
+    voxel_index: np.ndarray,
+    ) -> np.ndarray:
+    """
+    Read the doses of the given voxels for gaze angles from an open h5 file.
+    Only the contiguous grid range spanned by the voxels is read per angle.
+    Returns:
+    np.ndarray: Doses (angles x voxels).
+    """
+    lo, hi = int(voxel_index[0]), int(voxel_index[-1]) + 1
+    local_index = voxel_index - lo
+    doses = np.empty((len(angle_keys), len(voxel_index)), dtype=h5_file[angle_keys[0]].dtype)
+    for i, angle_key in enumerate(angle_keys):
+        doses[i] = h5_file[angle_key][lo:hi][local_index]
+    return doses
+
+def union_voxel_index(roi_masks: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Sorted dose grid indices of all voxels in at least one ROI.
+    """
+    return np.unique(np.concatenate([roi_masks[roi] for roi in roi_masks]))
+
+def open_roi_dose_store(
+    h5_file_path: str,
+    angle_keys: List[str],
+    roi_masks: Dict[str, np.ndarray],
+    roi_relative_values: Dict[str, np.ndarray],
+    voxel_vol: float
+    ) -> ROIDoseStore:
+    """
+    Dose store that reads the dose rows of gaze angles from the h5 file on first access.
+    """
+    return ROIDoseStore(
+        angle_keys=angle_keys,
+        voxel_index=union_voxel_index(roi_masks),
+        roi_names=list(roi_masks),
+        roi_masks=roi_masks,
+        roi_relative_values=roi_relative_values,
+        voxel_vol=voxel_vol,
+        h5_file_path=h5_file_path,
+    )
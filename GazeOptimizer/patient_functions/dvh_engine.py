@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+import numpy as np
+
+
+class DVHEngine:
+    """
+    Batched cumulative DVH computation.
+
+    All ROI voxels of a patient are gathered with a single index array, so a
+    stack of dose vectors (plans x voxels) is turned into the DVHs of every
+    plan and every ROI with one gather and one segmented bincount instead of
+    one `cumulative_dvh` call per plan and ROI.
+    """
+    def __init__(
+        self,
+        roi_names: List[str],
+        roi_masks: Dict[str, np.ndarray],
+        roi_relative_values: Dict[str, np.ndarray],
+        voxel_vol: float,
+        bins: int=200,
+        max_dose: np.ndarray=None,
+        n_voxels: int=None,
+        ):
+        """
+        Parameters:
+        roi_names (List[str]): ROIs to compute DVHs for, defines the ROI axis of the output.
+        roi_masks (dict): Voxel indices of each ROI in the flattened dose grid.
+        roi_relative_values (dict): Relative volume of each ROI voxel.
+        voxel_vol (float): Volume of a single dose grid voxel.
+        bins (int): Number of dose bins per DVH.
+        max_dose (float or np.ndarray, optional): Fixed upper bin edge, a scalar for the whole 
+            patient or one value per ROI. If None, each DVH is binned up to its own maximum dose.
+        n_voxels (int, optional): Length of the dose vectors `roi_masks` index into, e.g. the
+            voxels of a patient's ROIDoseStore. Dose vectors of another length are rejected.
+        """
+        self.roi_names = list(roi_names)
+        self.n_rois = len(self.roi_names)
+        self.bins = bins
+        self.max_dose = max_dose
+        self.n_voxels = n_voxels
+
+        #one gather index over all ROIs, ROI i occupies [roi_offsets[i], roi_offsets[i+1])
+        roi_sizes = np.array([len(roi_masks[roi]) for roi in self.roi_names])
+        self.roi_offsets = np.concatenate([[0], np.cumsum(roi_sizes)])
+        self.gather_index = np.concatenate([np.asarray(roi_masks[roi]) for roi in self.roi_names]).astype(np.intp)
+        self.roi_index = np.repeat(np.arange(self.n_rois), roi_sizes)
+
+        #volume contributed by each gathered voxel and total volume per ROI
+        self.voxel_volumes = np.concatenate([roi_relative_values[roi] for roi in self.roi_names]) * voxel_vol
+        self.total_volumes = np.bincount(self.roi_index, weights=self.voxel_volumes, minlength=self.n_rois)
+
+    def __str__(self):
+        return f'DVHEngine for {self.n_rois} ROIs, {len(self.gather_index)} voxels, {self.bins} bins'
+
+    def gather(self, doses: np.ndarray) -> np.ndarray:
+        """
+        Extract the ROI voxels from dose vectors.
+        Parameters:
+        doses (np.ndarray): Dose vector or stack of dose vectors (plans x `n_voxels`).
+        Returns:
+        np.ndarray: Gathered doses (plans x ROI voxels).
+        """
+        doses = np.atleast_2d(doses)
+        if self.n_voxels is not None and doses.shape[1] != self.n_voxels:
+            raise ValueError(
+                f"Dose vectors have {doses.shape[1]} voxels, expected {self.n_voxels}. Pass rows of the "
+                f"patient's dose store (e.g. patient.dose_store.dose(angle_key)), not full-grid doses."
+            )
+        return doses[:, self.gather_index]
+
+    def check_gathered(self, roi_dose: np.ndarray) -> np.ndarray:
+        """
+        Reject gathered doses that do not hold one value per gathered ROI voxel.
+        """
+        roi_dose = np.atleast_2d(roi_dose)
+        if roi_dose.shape[1] != len(self.gather_index):
+            raise ValueError(f"Gathered doses have {roi_dose.shape[1]} voxels, expected {len(self.gather_index)}.")
+        return roi_dose
+
+    @property
+    def fixed_edges(self):
+        return self.max_dose is not None
+
+    def roi_max_dose(
+        self,
+        doses: np.ndarray,
+        gathered: bool=False
+        ) -> np.ndarray:
+        """
+        Maximum dose of each ROI for a stack of dose vectors (plans x ROIs).
+        """
+        roi_dose = self.check_gathered(doses) if gathered else self.gather(doses)
+        return np.maximum.reduceat(roi_dose, self.roi_offsets[:-1], axis=1)
+
+    def edges(self) -> np.ndarray:
+        """
+        Fixed bin edges of each ROI (ROIs x bins+1). Only available if `max_dose` is set.
+        """
+        if not self.fixed_edges:
+            raise ValueError("DVH bin edges are only fixed if max_dose is set.")
+        max_dose = np.broadcast_to(np.asarray(self.max_dose, dtype=float), (self.n_rois,))
+        return np.linspace(0, max_dose, self.bins + 1, axis=1)
+
+    def bin_centers(self) -> np.ndarray:
+        """
+        Fixed bin center doses of each ROI (ROIs x bins). Only available if `max_dose` is set.
+        """
+        if not self.fixed_edges:
+            raise ValueError("DVH bin centers are only fixed if max_dose is set.")
+        step = np.broadcast_to(np.asarray(self.max_dose, dtype=float), (self.n_rois,)) / self.bins
+        return (np.arange(self.bins) + 0.5)[None, :] * step[:, None]
+
+    def compute(
+        self,
+        doses: np.ndarray,
+        gathered: bool=False
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute cumulative DVHs of all ROIs for a stack of dose vectors.
+        Bin edges run from 0 to `max_dose` if set, so all DVHs of a ROI share one dose axis.
+        Otherwise they run to the maximum dose of each plan within each ROI, the same 
+        binning `cumulative_dvh` uses for a single DVH.
+        Parameters:
+        doses (np.ndarray): Dose vector or stack of dose vectors (plans x `n_voxels`), e.g. dose store rows.
+        gathered (bool): If True, `doses` already holds only the gathered ROI voxels.
+        Returns:
+        Tuple[np.ndarray]: Bin center doses and cumulative volumes in %, both (plans x ROIs x bins).
+            With fixed edges the doses are a read-only broadcast of a single (ROIs x bins) axis.
+        """
+        roi_dose = self.check_gathered(doses) if gathered else self.gather(doses)
+        n_plans = roi_dose.shape[0]
+        bins = self.bins
+
+        #maximum dose per plan and ROI defines the bin width
+        if self.fixed_edges:
+            dmax = np.broadcast_to(np.asarray(self.max_dose, dtype=float), (n_plans, self.n_rois))
+        else:
+            dmax = self.roi_max_dose(roi_dose, gathered=True)
+        step = dmax / bins
+
+        #bin index of every voxel, voxels of a zero-dose ROI all land in the last bin
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bin_idx = np.floor(roi_dose / step[:, self.roi_index])
+        bin_idx = np.nan_to_num(bin_idx, nan=bins-1, posinf=bins-1)
+        bin_idx = np.clip(bin_idx, 0, bins-1).astype(np.intp)
+
+        #segmented bincount: one segment of `bins` entries per plan and ROI
+        segment = np.arange(n_plans)[:, None] * self.n_rois + self.roi_index[None, :]
+        flat_idx = (segment * bins + bin_idx).ravel()
+        weights = np.broadcast_to(self.voxel_volumes, roi_dose.shape).ravel()
+        diff = np.bincount(flat_idx, weights=weights, minlength=n_plans*self.n_rois*bins)
+        diff = diff.reshape(n_plans, self.n_rois, bins)
+
+        # cumulative from high dose to low dose
+        volume = np.cumsum(diff[:, :, ::-1], axis=2)[:, :, ::-1] / self.total_volumes[None, :, None] * 100
+        if self.fixed_edges:
+            dose = np.broadcast_to(self.bin_centers(), volume.shape)
+        else:
+            dose = (np.arange(bins) + 0.5)[None, None, :] * step[:, :, None]
+        return dose, volume
+
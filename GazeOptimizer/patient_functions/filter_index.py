@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict
+import numpy as np
+
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+from GazeOptimizer.patient_functions.memo import MemoCache
+
+#maximum number of cached single filter masks
+FILTER_MASK_MEMO_SIZE = 256
+
+
+class FilterIndex:
+    """
+    Dx of all plans of a plan set, looked up per ROI and volume.
+
+    A filter `(roi, volume, dose)` keeps the plans whose Dx at `volume` is below `dose`. The Dx
+    columns come from `PlanSet.metric`, which computes the exact Dx of all plans at once and
+    memoizes it with the other metrics of the set, further filters at that volume are one
+    vectorized compare. Clicked volumes are arbitrary floats, so no fixed grid of columns is
+    built up front. Filters of several ROIs combine as boolean ANDs.
+    """
+    def __init__(
+        self,
+        plan_set: PlanSet
+        ):
+        """
+        Parameters:
+        plan_set (PlanSet): Plans to filter, masks follow the order of the set.
+        """
+        self.plan_set = plan_set
+
+    def __str__(self):
+        return f'FilterIndex for {len(self.plan_set)} plans'
+
+    def __len__(self):
+        return len(self.plan_set)
+
+    def dose_at_volume(self, roi: str, volume: float) -> np.ndarray:
+        """
+        Dx of all plans at a volume (%), memoized on the plan set.
+        """
+        return self.plan_set.metric(roi, 'D', volume)
+
+    def dose_mask(self, roi: str, volume: float, max_dose: float) -> np.ndarray:
+        """
+        Plans whose Dx at `volume` is below `max_dose`.
+        """
+        return self.dose_at_volume(roi, volume) < max_dose
+
+    def mask(self, filter_dict: Dict[str, Dict[str, float]], eps: float=0.) -> np.ndarray:
+        """
+        Plans passing all filters, {roi: {'dose': max dose, 'volume': volume}}.
+        `eps` is added to every maximum dose.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for roi, f in filter_dict.items():
+            keep &= self.dose_mask(roi, volume=f['volume'], max_dose=f['dose']+eps)
+        return keep
+
+
+class FilterMasks:
+    """
+    Cached masks of single filters, ANDed into the mask of a set of filters.
+
+    The mask of every single filter is cached, keyed by its ROI, dose and volume, so filters
+    that were applied before never touch the plan set again. No filters are stored: one instance
+    is shared by all sessions showing a patient, each passes its own filters to `mask`. The
+    cache and the filter index are guarded by a lock, callbacks may run in several threads.
+    """
+    def __init__(
+        self,
+        filter_index: FilterIndex,
+        eps: float=0.
+        ):
+        """
+        Parameters:
+        filter_index (FilterIndex): Index the filter masks are computed with.
+        eps (float): Added to the maximum dose of every filter.
+        """
+        self.filter_index = filter_index
+        self.eps = eps
+        self.memo = MemoCache(maxsize=FILTER_MASK_MEMO_SIZE)
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f'FilterMasks with {len(self.memo)} cached filter masks'
+
+    def filter_mask(self, roi: str, dose: float, volume: float) -> np.ndarray:
+        """
+        Cached mask of a single filter.
+        """
+        with self.lock:
+            return self.memo.get_or_compute(
+                (roi, float(dose), float(volume)),
+                lambda: self.filter_index.dose_mask(roi, volume=volume, max_dose=dose+self.eps)
+            )
+
+    def mask(self, filter_dict: Dict[str, Dict[str, float]]) -> np.ndarray:
+        """
+        Mask of the plans passing all filters, {roi: {'dose': max dose, 'volume': volume}}.
+        Returns a new array, cached masks are never modified.
+        """
+        keep = np.ones(len(self.filter_index), dtype=bool)
+        for roi, f in filter_dict.items():
+            keep &= self.filter_mask(roi, f['dose'], f['volume'])
+        return keep
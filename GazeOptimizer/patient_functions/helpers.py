@@ -2,11 +2,18 @@ from __future__ import annotations
 from typing import List, Tuple
 import numpy as np
 
-def cumulative_dvh(dose, frac, voxel_vol, bins=1000):
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+
+def cumulative_dvh(dose, frac, voxel_vol, bins=1000, dmax=None):
+    """
+    Cumulative DVH of a single ROI. Bin edges run from 0 to `dmax`, which defaults to the
+    maximum dose. Pass a fixed `dmax` (e.g. per patient or per ROI) to give DVHs of 
+    different plans the same dose axis.
+    """
     assert dose.shape == frac.shape
     v = frac * voxel_vol  # volume contributed by each voxel
     dmin = 0
-    dmax = float(dose.max())
+    dmax = float(dose.max()) if dmax is None else float(dmax)
     
     total_vol = np.sum(v)
 
@@ -110,14 +117,9 @@ def find_best_plan(plans: List[TreatmentPlan]) -> TreatmentPlan:
     Returns:
     TreatmentPlan: The plan with the lowest cost.
     """
-    best_plan = None
-    lowest_cost = float('inf')
-    for plan in plans:
-        cost = plan.calculate_cost()
-        if cost < lowest_cost:
-            lowest_cost = cost
-            best_plan = plan
-    return best_plan
+    plan_set = PlanSet(plans)
+    costs, _ = plan_set.patient.cost_model.evaluate(plan_set)
+    return plan_set[int(np.argmin(costs))]
 
 def roi_in_metrics(
     roi: str, 
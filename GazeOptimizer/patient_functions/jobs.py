@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from typing import Dict, List
+
+#states of a job, the last three are final
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINAL_STATES = [DONE, FAILED, CANCELLED]
+
+#minimum time between two progress writes of a running job in seconds
+STATUS_INTERVAL = 0.25
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_path(jobs_dir: str, job_id: str, suffix: str='json') -> str:
+    if os.path.basename(job_id) != job_id or job_id.startswith('.'):
+        raise ValueError(f"Invalid job ID {job_id}.")
+    return os.path.join(jobs_dir, f'{job_id}.{suffix}')
+
+def read_job(jobs_dir: str, job_id: str) -> Dict:
+    with open(job_path(jobs_dir, job_id)) as f:
+        return json.load(f)
+
+def write_job(jobs_dir: str, job: Dict):
+    """
+    Replace the status file of a job atomically, readers never see partial files.
+    """
+    path = job_path(jobs_dir, job['id'])
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f, indent=1)
+    os.replace(tmp_path, path)
+
+def update_job(jobs_dir: str, job_id: str, **changes) -> Dict:
+    job = read_job(jobs_dir, job_id)
+    job.update(changes)
+    write_job(jobs_dir, job)
+    return job
+
+def finish_job(jobs_dir: str, job_id: str, state: str, **changes) -> Dict:
+    """
+    Move a job to a final state and remove its claim and cancel files.
+    """
+    job = update_job(jobs_dir, job_id, state=state, finished=time.time(), **changes)
+    for suffix in ['claim', 'cancel']:
+        try:
+            os.remove(job_path(jobs_dir, job_id, suffix))
+        except FileNotFoundError:
+            pass
+    return job
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def run_precompute_job(jobs_dir: str, job_id: str):
+    """
+    Build and cache the plan set of a job's patient, entry point of the job process.
+    Progress is written to the job's status file, a cancel flag file stops the job at the
+    next progress update.
+    """
+    from GazeOptimizer.patient_functions.patient import Patient
+    from GazeOptimizer.patient_functions.precompute import precompute_plan_set
+
+    job = update_job(jobs_dir, job_id, state=RUNNING, pid=os.getpid(), started=time.time(), step='load patient')
+    last_write = 0.
+
+    def check_cancel():
+        if os.path.exists(job_path(jobs_dir, job_id, 'cancel')):
+            raise JobCancelled()
+
+    def on_step(step):
+        check_cancel()
+        update_job(jobs_dir, job_id, step=step, step_started=time.time(), done=0, total=0)
+
+    def progress(done, total):
+        nonlocal last_write
+        check_cancel()
+        if time.time() - last_write >= STATUS_INTERVAL or done == total:
+            update_job(jobs_dir, job_id, done=int(done), total=int(total), updated=time.time())
+            last_write = time.time()
+
+    try:
+        params = job['params']
+        patient = Patient(
+            patient_id=job['patient_id'],
+            h5_file_path=params['h5_file_path'],
+            num_dvh_bins=params['bins'],
+            dvh_edges=params['dvh_edges']
+        )
+        check_cancel()
+        plan_set, path = precompute_plan_set(
+            patient=patient,
+            n_steps=params['n_steps'],
+            cache_dir=params['cache_dir'],
+            workers=params['workers'],
+            verbose=False,
+            progress=progress,
+            on_step=on_step
+        )
+        finish_job(jobs_dir, job_id, DONE, step=None, n_plans=len(plan_set), cache_path=path)
+    except JobCancelled:
+        finish_job(jobs_dir, job_id, CANCELLED)
+    except Exception as e:
+        finish_job(jobs_dir, job_id, FAILED, error=f'{e!r}\n{traceback.format_exc()}')
+
+
+class JobQueue:
+    """
+    Local queue of precompute jobs, run one at a time in a background process.
+
+    Every job is a JSON status file in `jobs_dir`, written by the queue and by the job's
+    process and read by `status`, so the status of a job outlives the page that submitted it
+    and the server process. A scheduler thread starts the oldest queued job in a fresh Python
+    process (`python -m GazeOptimizer.patient_functions.jobs`), so the job never imports the
+    app, and waits for it. Jobs are claimed with an exclusive lock file, so several servers sharing
+    `jobs_dir` never run a job twice, the lock file holds the claiming process ID. Jobs claimed
+    or left running by a process that is gone are failed. Lock and cancel files are removed
+    when a job finishes.
+    """
+    def __init__(
+        self,
+        jobs_dir: str,
+        poll_interval: float=1.
+        ):
+        """
+        Parameters:
+        jobs_dir (str): Directory of the job status files, created if missing.
+        poll_interval (float): Seconds between two checks for queued jobs while idle.
+        """
+        self.jobs_dir = jobs_dir
+        self.poll_interval = poll_interval
+        self.process = None
+        self.thread = None
+        self.wakeup = threading.Event()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        self.fail_orphans()
+        if any(job['state'] == QUEUED for job in self.jobs()):
+            self.start()
+
+    def __str__(self):
+        states = [job['state'] for job in self.jobs()]
+        return f'JobQueue in {self.jobs_dir}: ' + ', '.join(f'{states.count(s)} {s}' for s in [QUEUED, RUNNING, DONE, FAILED, CANCELLED])
+
+    def start(self):
+        """
+        Start the scheduler thread if it is not running yet.
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.run, name='JobQueue', daemon=True)
+            self.thread.start()
+
+    def submit(
+        self,
+        patient_id: str,
+        h5_file_path: str,
+        n_steps: int=10,
+        cache_dir: str='data/cache',
+        dvh_edges: str='roi',
+        bins: int=200,
+        workers: int=1
+        ) -> str:
+        """
+        Queue a precompute job, parameters as for `gazeopt.py precompute`.
+        Returns:
+        str: Job ID.
+        """
+        job_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{patient_id}-{uuid.uuid4().hex[:6]}'
+        write_job(self.jobs_dir, {
+            'id': job_id,
+            'patient_id': str(patient_id),
+            'state': QUEUED,
+            'created': time.time(),
+            'params': {
+                'h5_file_path': h5_file_path,
+                'n_steps': int(n_steps),
+                'cache_dir': cache_dir,
+                'dvh_edges': dvh_edges,
+                'bins': int(bins),
+                'workers': int(workers),
+            },
+        })
+        self.start()
+        self.wakeup.set()
+        return job_id
+
+    def cancel(self, job_id: str):
+        """
+        Cancel a job: queued jobs are cancelled at once, running jobs at their next progress update.
+        """
+        job = read_job(self.jobs_dir, job_id)
+        if job['state'] == QUEUED and self.claim(job_id):
+            finish_job(self.jobs_dir, job_id, CANCELLED)
+        elif job['state'] not in FINAL_STATES:
+            open(job_path(self.jobs_dir, job_id, 'cancel'), 'w').close()
+
+    def status(self, job_id: str) -> Dict:
+        """
+        Status of a job with its progress (0-1) in the current step and the estimated seconds left.
+        """
+        job = read_job(self.jobs_dir, job_id)
+        job['cancel_requested'] = os.path.exists(job_path(self.jobs_dir, job_id, 'cancel'))
+        done, total = job.get('done', 0), job.get('total', 0)
+        job['progress'] = 1. if job['state'] == DONE else (done / total if total > 0 else 0.)
+        job['eta'] = None
+        if job['state'] == RUNNING and 0 < done < total:
+            elapsed = job.get('updated', time.time()) - job['step_started']
+            job['eta'] = elapsed / done * (total - done)
+        return job
+
+    def jobs(self) -> List[Dict]:
+        """
+        All jobs, oldest first.
+        """
+        job_ids = [name[:-len('.json')] for name in os.listdir(self.jobs_dir) if name.endswith('.json')]
+        jobs = []
+        for job_id in job_ids:
+            try:
+                jobs.append(read_job(self.jobs_dir, job_id))
+            except (OSError, ValueError):
+                continue
+        return sorted(jobs, key=lambda job: job['created'])
+
+    def claim(self, job_id: str) -> bool:
+        """
+        Claim a queued job, only the first caller succeeds. Jobs that finished before the claim
+        (e.g. cancelled, which removes the lock file) are released again.
+        """
+        path = job_path(self.jobs_dir, job_id, 'claim')
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        if read_job(self.jobs_dir, job_id)['state'] != QUEUED:
+            os.remove(path)
+            return False
+        return True
+
+    def claimer(self, job_id: str) -> int:
+        """
+        Process ID holding the claim of a job, None if it is not claimed.
+        """
+        try:
+            with open(job_path(self.jobs_dir, job_id, 'claim')) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return None
+
+    def fail_orphans(self):
+        """
+        Fail jobs claimed or run by processes that are gone.
+        """
+        for job in self.jobs():
+            if job['state'] == RUNNING and not process_alive(job['pid']):
+                finish_job(self.jobs_dir, job['id'], FAILED, error='Job process ended unexpectedly.')
+            elif job['state'] == QUEUED:
+                pid = self.claimer(job['id'])
+                if pid is not None and (pid == 0 or not process_alive(pid)):
+                    finish_job(self.jobs_dir, job['id'], FAILED, error='Claiming process ended before the job started.')
+
+    def run(self):
+        """
+        Scheduler loop: run queued jobs one after the other.
+        """
+        while True:
+            queued = [job for job in self.jobs() if job['state'] == QUEUED]
+            job = next((job for job in queued if self.claim(job['id'])), None)
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            self.process = subprocess.Popen([sys.executable, '-m', __name__, self.jobs_dir, job['id']])
+            self.process.wait()
+            if read_job(self.jobs_dir, job['id'])['state'] not in FINAL_STATES:
+                finish_job(self.jobs_dir, job['id'], FAILED, error=f'Job process exited with code {self.process.returncode}.')
+            self.process = None
+
+
+if __name__ == '__main__':
+    run_precompute_job(jobs_dir=sys.argv[1], job_id=sys.argv[2])
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class MemoCache:
+    """
+    Bounded least-recently-used memo of derived values with hit/miss counters.
+    Entries are only dropped when the cache is full or `clear` is called explicitly.
+    """
+    def __init__(self, maxsize: int=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return f'MemoCache with {len(self)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get_or_compute(self, key: Hashable, compute: Callable):
+        """
+        Return the memoized value of `key`, calling `compute()` on a miss.
+        """
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = compute()
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return value
+
+    def put(self, key: Hashable, value):
+        """
+        Store a value computed elsewhere, e.g. loaded from disk.
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Invalidate all entries, counters are kept.
+        """
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self), 'maxsize': self.maxsize}
+
+
+def is_scalar_key(value) -> bool:
+    """
+    Only scalar metric arguments are used as memo keys.
+    """
+    return isinstance(value, (int, float)) or (hasattr(value, 'ndim') and value.ndim == 0)
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Tuple
+import numpy as np
+
+from GazeOptimizer.patient_functions.combination import combine_doses
+
+#chunks handed out per worker, more chunks balance the load better
+CHUNKS_PER_WORKER = 4
+
+#state of a worker process, set once by `_init_worker`
+_angle_doses = None
+_dvh_engine = None
+
+
+def _init_worker(doses_path: str, dvh_engine):
+    global _angle_doses, _dvh_engine
+    _angle_doses = np.load(doses_path, mmap_mode='r')
+    _dvh_engine = dvh_engine
+
+def _sweep_chunk(task):
+    """
+    DVHs of one chunk of rows. With fixed edges only the volumes are sent back,
+    the shared dose axis is rebuilt by the parent.
+    """
+    start, idx_1, idx_2, weights = task
+    doses = combine_doses(_angle_doses, idx_1, idx_2, weights)
+    dvh_dose, dvh_volume = _dvh_engine.compute(doses, gathered=True)
+    return start, (None if _dvh_engine.fixed_edges else dvh_dose), dvh_volume
+
+
+class ParallelSweep:
+    """
+    Two-beam DVH sweep partitioned over a process pool.
+
+    The gathered gaze angle doses of a `TwoBeamCombiner` are written once to a
+    .npy file that every worker memory-maps read-only, so dose arrays are never
+    pickled. Workers receive contiguous chunks of (angle index 1, angle index 2, weight)
+    rows and return only their DVH rows. Every row is computed independently of its
+    chunk, and chunks are yielded in order, so the result is identical to the serial sweep.
+    """
+    def __init__(
+        self,
+        combiner,
+        workers: int
+        ):
+        """
+        Parameters:
+        combiner (TwoBeamCombiner): Combiner holding the gathered doses and DVH engine.
+        workers (int): Number of worker processes.
+        """
+        self.combiner = combiner
+        self.dvh_engine = combiner.patient.dvh_engine
+        self.workers = workers
+
+    def chunk_rows(self, n_rows: int) -> int:
+        """
+        Rows per chunk, bounded by the combiner's memory limit and small enough to keep all workers busy.
+        """
+        per_worker = -(-n_rows // (self.workers * CHUNKS_PER_WORKER))
+        return max(1, min(self.combiner.rows_per_chunk, per_worker))
+
+    def iter_dvhs(
+        self,
+        idx_1: np.ndarray,
+        idx_2: np.ndarray,
+        weights: np.ndarray
+        ) -> Iterator[Tuple[slice, np.ndarray, np.ndarray]]:
+        """
+        Same chunks as `TwoBeamCombiner.iter_dvhs`, computed by the worker processes.
+        """
+        n_rows = len(weights)
+        step = self.chunk_rows(n_rows)
+        tasks = [(start, idx_1[start:start+step], idx_2[start:start+step], weights[start:start+step]) for start in range(0, n_rows, step)]
+
+        tmp_dir = tempfile.mkdtemp(prefix='gazeopt_sweep_')
+        try:
+            doses_path = os.path.join(tmp_dir, 'angle_doses.npy')
+            np.save(doses_path, np.ascontiguousarray(self.combiner.angle_doses))
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(doses_path, self.dvh_engine)
+                ) as executor:
+                for start, dvh_dose, dvh_volume in executor.map(_sweep_chunk, tasks):
+                    if dvh_dose is None:
+                        dvh_dose = np.broadcast_to(self.dvh_engine.bin_centers(), dvh_volume.shape)
+                    yield slice(start, start+len(dvh_volume)), dvh_dose, dvh_volume
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
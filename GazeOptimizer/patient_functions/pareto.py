@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+def dominates(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Whether a dominates b (all objectives <=, at least one <), broadcast over rows.
+    """
+    return np.all(a <= b, axis=-1) & np.any(a < b, axis=-1)
+
+def pareto_front(values: np.ndarray) -> np.ndarray:
+    """
+    Non-dominated rows of an objective matrix, all objectives are minimized.
+    Parameters:
+    values (np.ndarray): Objective values (points x objectives).
+    Returns:
+    np.ndarray: Boolean mask of the Pareto-optimal points. Identical points are all kept.
+    """
+    values = np.asarray(values, dtype=float)
+    n_points = len(values)
+    if n_points == 0 or values.shape[1] == 0:
+        return np.ones(n_points, dtype=bool)
+    if values.shape[1] == 1:
+        return values[:, 0] == values[:, 0].min()
+    if values.shape[1] == 2:
+        return _pareto_front_2d(values)
+
+    #a point can only be dominated by points with a smaller sum, so the point with the
+    #smallest sum among the remaining ones is always optimal. Every round removes all
+    #points it dominates, the number of rounds is the size of the front.
+    order = np.argsort(values.sum(axis=1), kind='stable')
+    remaining = values[order]
+    remaining_idx = order
+    front = []
+    while len(remaining) > 0:
+        best = remaining[0]
+        front.append(remaining_idx[0])
+        keep = ~dominates(best, remaining[1:])
+        remaining, remaining_idx = remaining[1:][keep], remaining_idx[1:][keep]
+
+    mask = np.zeros(n_points, dtype=bool)
+    mask[front] = True
+    return mask
+
+def _pareto_front_2d(values):
+    """
+    Sort by the first objective (ties by the second), a point is optimal if its second
+    objective is below the running minimum of all points before it.
+    """
+    order = np.lexsort((values[:, 1], values[:, 0]))
+    x, y = values[order, 0], values[order, 1]
+    best_before = np.concatenate([[np.inf], np.minimum.accumulate(y)[:-1]])
+    optimal = y < best_before
+
+    #points identical to an optimal point are optimal as well
+    same_as_previous = np.concatenate([[False], (x[1:] == x[:-1]) & (y[1:] == y[:-1])])
+    for i in np.flatnonzero(same_as_previous):
+        optimal[i] = optimal[i-1]
+
+    mask = np.zeros(len(values), dtype=bool)
+    mask[order] = optimal
+    return mask
@@ -3,10 +3,24 @@ import h5py
 import pandas as pd
 import ast
 import time
+from collections.abc import Mapping
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import seaborn as sns
-from GazeOptimizer.patient_functions.helpers import cumulative_dvh, print_progress_bar
+from GazeOptimizer.patient_functions.helpers import print_progress_bar
+from GazeOptimizer.patient_functions.dvh_engine import DVHEngine
+from GazeOptimizer.patient_functions.dose_store import open_roi_dose_store
+from GazeOptimizer.patient_functions.combination import TwoBeamCombiner
+from GazeOptimizer.patient_functions.parallel_sweep import ParallelSweep
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+from GazeOptimizer.patient_functions.cost_model import CostModel
+from GazeOptimizer.patient_functions.memo import MemoCache, is_scalar_key
+from GazeOptimizer.patient_functions.weight_search import golden_section_search, grid_brackets
+from GazeOptimizer.patient_functions.angle_index import AngleIndex
+
+#maximum number of memoized values per object
+DVH_MEMO_SIZE = 32
+PLAN_MEMO_SIZE = 8
 
 class Metric:
     def __init__(self, roi, metric_type, metric_value): #D20_Macula
@@ -49,7 +63,7 @@ class Weights:
     
     def weight_for_roi(self, roi, default=1):
         for weight in self.weights:
-            if weight.metric.roi == roi:
+            if weight.metric.roi_name == roi:
                 return weight.value
         return default
 
@@ -90,69 +104,93 @@ class TreatmentPlan:
     def __init__(
         self,
         patient,
-        angle_key,
-        dose,
+        angle_key=None,
+        dose=None,
         angle_key_2=None,
         beam_weight=None,
+        dvh_dose=None,
+        dvh_volume=None,
+        angle_keys=None,
+        beam_weights=None,
     ):  
-        self.name = angle_key if angle_key_2 is None else f"{np.round(beam_weight, 2)}*{angle_key} + {np.round(1-beam_weight, 2)}*{angle_key_2}"
+        """
+        Either `dose` (a dose store row of the patient) or `dvh_dose` and `dvh_volume` (ROIs x bins, e.g. 
+        slices of the output of `DVHEngine.compute`) have to be given.
+        Beams are either `angle_key` (single beam), `angle_key`, `angle_key_2` and `beam_weight` (two beams, 
+        `beam_weight` is the weight of the first beam) or `angle_keys` with one weight per beam in `beam_weights`.
+        For more than two beams `angle_key_2` and `beam_weight` only describe the first two beams.
+        """
         self.patient = patient
-        self.angle_key = angle_key
-        self.angle_key_2 = None
-        self.beam_weight=None
-        if angle_key_2 is not None or beam_weight is not None:
-
-            if angle_key_2 is not None and beam_weight is not None:
-                self.beam_weight = beam_weight
-                self.angle_key_2 = angle_key_2
-            else:
+        if angle_keys is None:
+            if (angle_key_2 is None) != (beam_weight is None):
                 raise ValueError(f"Either both angle_key_2 ({angle_key_2}) and beam_weight ({beam_weight}) have to be specified or none.")
+            angle_keys = [angle_key] if angle_key_2 is None else [angle_key, angle_key_2]
+            beam_weights = [1.] if beam_weight is None else [beam_weight, 1-beam_weight]
+        elif beam_weights is None or len(beam_weights) != len(angle_keys):
+            raise ValueError(f"One beam weight per angle key is required, got {beam_weights} for {angle_keys}.")
+
+        self.angle_keys = list(angle_keys)
+        self.beam_weights = np.asarray(beam_weights, dtype=float)
+        self.angle_key = self.angle_keys[0]
+        self.angle_key_2 = self.angle_keys[1] if self.n_beams > 1 else None
+        self.beam_weight = None
+        if self.n_beams > 1:
+            self.beam_weight = beam_weight if beam_weight is not None else self.beam_weights[0]
+
+        if self.n_beams == 1:
+            self.name = self.angle_key
+        else:
+            self.name = ' + '.join([f"{np.round(w, 2)}*{key}" for w, key in zip(beam_weights, self.angle_keys)])
+
+        if dvh_dose is None or dvh_volume is None:
+            if dose is None:
+                raise ValueError("Either dose or dvh_dose and dvh_volume have to be specified.")
+            dvh_dose, dvh_volume = patient.dvh_engine.compute(dose)
+            dvh_dose, dvh_volume = dvh_dose[0], dvh_volume[0]
 
         self.roi_names = patient.roi_names
         self.dvhs = {}
-        for roi_name in self.roi_names:
-            self.dvhs[roi_name] = DVH(patient, roi_name, dose)
+        for i, roi_name in enumerate(self.roi_names):
+            self.dvhs[roi_name] = DVH(patient, roi_name, dose=dvh_dose[i], volume=dvh_volume[i])
     
 
     def __str__(self):
-        if self.angle_key_2!=None:
+        if self.n_beams > 2:
+            return f'Treatment Plan for Patient {self.patient.patient_id}, Angle Keys: {", ".join(self.angle_keys)}, Weights: {np.round(self.beam_weights, 2)}'
+        elif self.angle_key_2!=None:
             return f'Treatment Plan for Patient {self.patient.patient_id}, Angle Key: {self.angle_key}, Second Angle Key: {self.angle_key_2}, Weight: {self.beam_weight}'
         else:
             return f'Treatment Plan for Patient {self.patient.patient_id}, Angle Key: {self.angle_key}'
+
+    @property
+    def n_beams(self):
+        return len(self.angle_keys)
     
+    @property
+    def memo(self):
+        if getattr(self, '_memo', None) is None:
+            self._memo = MemoCache(maxsize=PLAN_MEMO_SIZE)
+        return self._memo
+
+    def invalidate(self):
+        """
+        Drop memoized costs of the plan and memoized metrics of its DVHs.
+        """
+        self.memo.clear()
+        for dvh in self.dvhs.values():
+            dvh.invalidate()
+
     def calculate_cost(self):
-        metric_term = self.calculate_metric_term()
-        volume_term = self.calculate_volume_term()
-        self.cost = metric_term + volume_term
+        self.cost = sum(self.calculate_contributions().values())
         return self.cost
 
     def calculate_volume_term(self):
-        volume_term = 0
-        for roi_name in self.patient.roi_names:
-            w = self.patient.weights.weight_for_roi(roi_name)
-            x = self.dvhs[roi_name].get_dvh_auc()/100
-            volume_term += w * x
-        return volume_term
+        return self.calculate_contributions()['Volume Term']
     
     def calculate_metric_term(self, output_contributions=False):
-        contributions = {}
-        metric_term = 0
-
-        #iterate over all weights
-        for weight in self.patient.weights:
-            
-            #if metric is D_v
-            if weight.metric.metric_type == 'D':
-                metric_value = self.dvhs[weight.metric.roi].get_dose_at_volume(volume=weight.value)
-            
-            #if metric is V_d
-            else: 
-                metric_value = self.dvhs[weight.metric.roi].get_volume_at_dose(dose=weight.value)
-            
-            #calculate contribution
-            contribution = weight.value * metric_value
-            contributions[weight.metric.name] = contribution
-            metric_term += contribution
+        contributions = self.calculate_contributions()
+        del contributions['Volume Term']
+        metric_term = sum(contributions.values())
 
         #return contributions if requested
         if output_contributions:
@@ -162,9 +200,12 @@ class TreatmentPlan:
         return metric_term
     
     def calculate_contributions(self):
-        _, contributions = self.calculate_metric_term(output_contributions=True)
-        contributions['Volume Term'] = self.calculate_volume_term()
-        return contributions
+        cost_model = self.patient.cost_model
+        contributions = self.memo.get_or_compute(
+            ('contributions', cost_model), 
+            lambda: cost_model.evaluate(PlanSet([self]))[1][0]
+        )
+        return cost_model.contributions_dict(contributions)
     
     def plot_dvhs(self, ax):
         for roi in self.roi_names:
@@ -177,16 +218,31 @@ class DVH:
         self,
         patient,
         roi_name,
-        dose
+        dose,
+        volume
         ):
+        """
+        Cumulative DVH of a single ROI. `dose` and `volume` are the bin center doses and
+        cumulative volumes in %, usually views into the arrays computed by `DVHEngine`.
+        """
         self.patient_id = patient.patient_id
         self.roi_name = roi_name
-        self.dose, self.volume = cumulative_dvh(
-            dose=dose[patient.roi_masks[self.roi_name]], 
-            frac=patient.roi_relative_values[self.roi_name], 
-            voxel_vol = patient.voxel_vol, 
-            bins=patient.num_dvh_bins)
+        self.dose = dose
+        self.volume = volume
+        self._memo = None
 
+    @property
+    def memo(self):
+        if self._memo is None:
+            self._memo = MemoCache(maxsize=DVH_MEMO_SIZE)
+        return self._memo
+
+    def invalidate(self):
+        """
+        Drop memoized metrics, needed if dose or volume are changed.
+        """
+        if self._memo is not None:
+            self._memo.clear()
 
     def __str__(self):
         return f'DVH for Patient {self.patient_id}, ROI: {self.roi_name}'
@@ -198,6 +254,14 @@ class DVH:
         return self.dose, self.volume
     
     def get_volume_at_dose(self, dose):
+        """
+        Return Vx: the volume (%) receiving at least dose. Memoized for scalar doses.
+        """
+        if is_scalar_key(dose):
+            return self.memo.get_or_compute(('V', float(dose)), lambda: self._volume_at_dose(dose))
+        return self._volume_at_dose(dose)
+
+    def _volume_at_dose(self, dose):
         """
         Return Vx: the volume (%) receiving at least dose.
         dvh_dose, dvh_volume can be ascending or descending; handles both.
@@ -215,6 +279,14 @@ class DVH:
         return np.interp(dose, dvh_dose, dvh_volume)
 
     def get_dose_at_volume(self, volume):
+        """
+        Return Dx: the dose corresponding to volume x. Memoized for scalar volumes.
+        """
+        if is_scalar_key(volume):
+            return self.memo.get_or_compute(('D', float(volume)), lambda: self._dose_at_volume(volume))
+        return self._dose_at_volume(volume)
+
+    def _dose_at_volume(self, volume):
         """#
         Return Dx: the dose corresponding to volume x.
         - x can be scalar or array (volume units).
@@ -236,7 +308,7 @@ class DVH:
         return np.interp(volume, dvh_volume, dvh_dose)
     
     def get_dvh_auc(self):
-        return np.trapz(y=self.volume, x=self.dose)
+        return self.memo.get_or_compute(('AUC',), lambda: np.trapz(y=self.volume, x=self.dose))
     
     def get_metric_value(self, metric: Metric):
         if self.roi_name != metric.roi_name:
@@ -246,6 +318,142 @@ class DVH:
             return self.get_dose_at_volume(metric.metric_value)
         else: return self.get_volume_at_dose(metric.metric_value)
 
+def build_treatment_plans(
+    patient, 
+    doses, 
+    angle_keys, 
+    angle_keys_2=None, 
+    beam_weights=None, 
+    gathered=False
+    ):
+    """
+    Build treatment plans for a stack of doses with a single batched DVH computation.
+    Parameters:
+    patient (Patient): Patient the doses belong to.
+    doses (np.ndarray): Stack of dose store rows (plans x store voxels).
+    angle_keys (List[str]): First gaze angle key of each plan.
+    angle_keys_2 (List[str], optional): Second gaze angle key of each plan (two beam plans).
+    beam_weights (List[float], optional): Weight of the first beam of each plan (two beam plans).
+    gathered (bool): If True, `doses` only holds the ROI voxels gathered by `patient.dvh_engine`.
+    Returns:
+    List[TreatmentPlan]: One plan per dose vector, its DVHs are views into the batched result.
+    """
+    dvh_dose, dvh_volume = patient.dvh_engine.compute(doses, gathered=gathered)
+    return plans_from_dvhs(
+        patient=patient,
+        dvh_dose=dvh_dose,
+        dvh_volume=dvh_volume,
+        angle_keys=angle_keys,
+        angle_keys_2=angle_keys_2,
+        beam_weights=beam_weights
+    )
+
+def plans_from_dvhs(
+    patient, 
+    dvh_dose, 
+    dvh_volume, 
+    angle_keys, 
+    angle_keys_2=None, 
+    beam_weights=None
+    ):
+    """
+    Wrap batched DVH arrays (plans x ROIs x bins) into treatment plans.
+    """
+    n_plans = dvh_dose.shape[0]
+    if angle_keys_2 is None: angle_keys_2 = [None]*n_plans
+    if beam_weights is None: beam_weights = [None]*n_plans
+
+    return [
+        TreatmentPlan(
+            patient=patient,
+            angle_key=angle_keys[i],
+            angle_key_2=angle_keys_2[i],
+            beam_weight=beam_weights[i],
+            dvh_dose=dvh_dose[i],
+            dvh_volume=dvh_volume[i]
+        )
+        for i in range(n_plans)
+    ]
+
+def build_two_beam_plans(
+    patient, 
+    weights, 
+    idx_1=None, 
+    idx_2=None, 
+    combiner=None,
+    progress=None,
+    workers=1
+    ):
+    """
+    Build two-beam treatment plans for pairs of gaze angles and beam weights without
+    materializing full-grid doses.
+    Parameters:
+    patient (Patient): Patient to build plans for.
+    weights (np.ndarray): Weights of the first beam, evaluated for every pair.
+    idx_1, idx_2 (np.ndarray, optional): Gaze angle indices of the pairs. All pairs if not given.
+    combiner (TwoBeamCombiner, optional): Combiner to reuse, created if not given.
+    progress (callable, optional): Called with (plans done, total plans) after every chunk.
+    workers (int): Number of worker processes, the sweep runs in this process if 1.
+    Returns:
+    List[TreatmentPlan]: Plans ordered by pair, then weight.
+    """
+    if combiner is None:
+        combiner = TwoBeamCombiner(patient)
+    row_1, row_2, row_w = combiner.pair_rows(weights=weights, idx_1=idx_1, idx_2=idx_2)
+    angle_keys = combiner.angle_keys
+
+    sweep = combiner if workers <= 1 else ParallelSweep(combiner, workers=workers)
+
+    plans = []
+    for rows, dvh_dose, dvh_volume in sweep.iter_dvhs(row_1, row_2, row_w):
+        plans += plans_from_dvhs(
+            patient=patient,
+            dvh_dose=dvh_dose,
+            dvh_volume=dvh_volume,
+            angle_keys=[angle_keys[i] for i in row_1[rows]],
+            angle_keys_2=[angle_keys[i] for i in row_2[rows]],
+            beam_weights=row_w[rows]
+        )
+        if progress is not None:
+            progress(rows.stop, len(row_w))
+    return plans
+
+def build_beam_plans(
+    patient,
+    idx,
+    weights,
+    combiner=None
+    ):
+    """
+    Build treatment plans with any number of beams without materializing full-grid doses.
+    Parameters:
+    patient (Patient): Patient to build plans for.
+    idx (np.ndarray): Gaze angle indices of the beams of every plan (plans x beams).
+    weights (np.ndarray): Beam weights of every plan (plans x beams).
+    combiner (TwoBeamCombiner, optional): Combiner to reuse, created if not given.
+    Returns:
+    List[TreatmentPlan]: One plan per row.
+    """
+    if combiner is None:
+        combiner = TwoBeamCombiner(patient)
+    idx = np.atleast_2d(idx)
+    weights = np.atleast_2d(weights)
+    angle_keys = combiner.angle_keys
+
+    plans = []
+    for rows, dvh_dose, dvh_volume in combiner.iter_beam_dvhs(idx, weights):
+        plans += [
+            TreatmentPlan(
+                patient=patient,
+                angle_keys=[angle_keys[i] for i in row_idx],
+                beam_weights=row_weights,
+                dvh_dose=dvh_dose[i],
+                dvh_volume=dvh_volume[i]
+            )
+            for i, (row_idx, row_weights) in enumerate(zip(idx[rows], weights[rows]))
+        ]
+    return plans
+
 class Patient:
     def __init__(
         self, 
@@ -253,14 +461,22 @@ class Patient:
         h5_file_path, 
         num_dvh_bins=200,
         weights={'D2_Macula': 3, 'D20_OpticalDisc': 3, 'D20_Cornea': 1, 'V55_Retina':1, 'V27_CiliaryBody': 1, 'D5_Lens': 1},
+        dvh_edges=None,
         ):
+        """
+        dvh_edges: None to bin every DVH up to its own maximum dose, 'roi' to share one dose axis
+        per ROI or 'patient' to share one dose axis for all ROIs.
+        """
         print(f'Initializing Patient {patient_id}...\n', end='\r')
+        if dvh_edges not in [None, 'roi', 'patient']:
+            raise ValueError(f"dvh_edges must be None, 'roi' or 'patient', not {dvh_edges}.")
         self.patient_id = patient_id
         self.h5_file_path = h5_file_path   
         self.weights = Weights(weights)
         self.num_dvh_bins = num_dvh_bins
+        self.dvh_edges = dvh_edges
 
-        #extract gaze angles, metrics, costs, and dvh data from h5py file
+        #extract gaze angles and roi metadata from h5py file, doses are only read when needed
         with h5py.File(self.h5_file_path, "r") as h5_file:
             f_keys = h5_file.keys()
             self.gaze_angle_keys = [key for key in f_keys if '(' in key]
@@ -271,53 +487,149 @@ class Patient:
             self.roi_relative_values = {roi_name: h5_file[f'{roi_name}_relative_volumes'][:] for roi_name in self.roi_names}
             self.voxel_vol = h5_file.attrs['voxel_volume']
 
-            self.gaze_angle_dvhs = {}
-            for gaze_angle_key in self.gaze_angle_keys:
-                dose = h5_file[gaze_angle_key][:]
-                self.gaze_angle_dvhs[gaze_angle_key] = TreatmentPlan(
-                                                            patient=self,
-                                                            angle_key=gaze_angle_key,
-                                                            dose=dose
-                                                            )
+        #only doses of voxels inside the ROIs are kept, each gaze angle is read once on first access
+        self.dose_store = open_roi_dose_store(
+            h5_file_path=self.h5_file_path,
+            angle_keys=self.gaze_angle_keys,
+            roi_masks=self.roi_masks,
+            roi_relative_values=self.roi_relative_values,
+            voxel_vol=self.voxel_vol
+        )
+
+        self.cost_model = CostModel(self.weights, roi_names=self.roi_names)
+        self._dvh_engine = None
+
+        #single beam plans are built on first access
+        self.gaze_angle_dvhs = GazeAnglePlans(self)
 
         #extract polar and azimuthal angles and theta for plotting
         self.polar = self.gaze_angles[:,0]
         self.azimuthal = self.gaze_angles[:,1]
         self.theta = np.deg2rad(self.azimuthal) #used for polar plots
+
+        #gaze angle lookup by (polar, azimuthal), e.g. of clicked points
+        self.gaze_angle_index = AngleIndex(self.polar, self.azimuthal)
     
     def __str__(self):
         return f'Patient {self.patient_id} with {len(self.gaze_angle_keys)} gaze angles and ROIs: {", ".join(self.roi_names)}'
 
-def find_best_beam_weight(patient, gaze_angle_key_1, gaze_angle_key_2, full_output=False, n_steps=10):
-    ws = np.linspace(0, 1, n_steps)
-    costs = []
-    plans = []
-    with h5py.File(patient.h5_file_path, "r") as h5_file:
-        dose_1 = h5_file[gaze_angle_key_1][:]
-        dose_2 = h5_file[gaze_angle_key_2][:]
-    for w in ws:
-        combined_dose = w*dose_1 + (1-w)*dose_2
-        
-        g = TreatmentPlan(
-            patient=patient,
-            angle_key=gaze_angle_key_1,
-            angle_key_2=gaze_angle_key_2,
-            dose=combined_dose,
-            beam_weight=w
-        )
-        cost = g.calculate_cost()
-        plans.append(g)
-        costs.append(cost)
-        del g
+    @property
+    def dvh_engine(self):
+        """
+        DVH engine working on dose store rows, created on first access.
+        """
+        if self._dvh_engine is None:
+            self._dvh_engine = DVHEngine(
+                roi_names=self.roi_names,
+                roi_masks=self.dose_store.roi_masks,
+                roi_relative_values=self.dose_store.roi_relative_values,
+                voxel_vol=self.voxel_vol,
+                bins=self.num_dvh_bins,
+                n_voxels=self.dose_store.n_voxels
+            )
+
+            #fixed bin edges up to the highest single beam dose. Two beam doses are convex
+            #combinations of single beam doses and therefore never exceed it.
+            if self.dvh_edges is not None:
+                roi_max_dose = self._dvh_engine.roi_max_dose(self.dose_store.doses).max(axis=0)
+                self._dvh_engine.max_dose = roi_max_dose if self.dvh_edges == 'roi' else roi_max_dose.max()
+        return self._dvh_engine
+
+class GazeAnglePlans(Mapping):
+    """
+    Single beam treatment plan of every gaze angle of a patient, built on first access.
+    """
+    def __init__(self, patient):
+        self.patient = patient
+        self.plans = {}
+
+    def __getitem__(self, angle_key):
+        if angle_key not in self.plans:
+            if angle_key not in self.patient.dose_store.angle_index:
+                raise KeyError(angle_key)
+            self.plans[angle_key] = TreatmentPlan(
+                patient=self.patient,
+                angle_key=angle_key,
+                dose=self.patient.dose_store.dose(angle_key)
+            )
+        return self.plans[angle_key]
+
+    def __iter__(self):
+        return iter(self.patient.gaze_angle_keys)
+
+    def __len__(self):
+        return len(self.patient.gaze_angle_keys)
+
+    def load_all(self):
+        """
+        Build all missing plans with a single batched DVH computation.
+        """
+        missing = [angle_key for angle_key in self if angle_key not in self.plans]
+        if len(missing) > 0:
+            doses = self.patient.dose_store.doses[[self.patient.dose_store.angle_index[k] for k in missing]]
+            self.plans.update(zip(missing, build_treatment_plans(patient=self.patient, doses=doses, angle_keys=missing)))
+        return self
+
+def find_best_beam_weight(
+    patient, 
+    gaze_angle_key_1, 
+    gaze_angle_key_2, 
+    full_output=False, 
+    n_steps=10, 
+    combiner=None, 
+    method='grid', 
+    tol=1e-3,
+    n_brackets=2,
+    return_evals=False
+    ):
+    """
+    Weight of the first beam minimizing the cost of a two beam plan.
+    method: 'grid' evaluates np.linspace(0, 1, n_steps). 'golden' evaluates the same grid and
+        refines the `n_brackets` lowest local minima of the grid by golden-section search until
+        the weight is known to `tol`. It is never worse than the grid, but only finds the exact
+        minimum if the cost is unimodal between the neighbours of one of these grid points.
+    full_output: Return all evaluated weights, costs and plans (sorted by weight) instead of the best one.
+    return_evals: Append the number of cost evaluations to the returned tuple.
+    """
+    if combiner is None:
+        combiner = TwoBeamCombiner(patient)
+    angle_index = patient.dose_store.angle_index
+    idx_1 = np.array([angle_index[gaze_angle_key_1]])
+    idx_2 = np.array([angle_index[gaze_angle_key_2]])
+
+    def evaluate(ws):
+        plans = build_two_beam_plans(patient=patient, weights=ws, idx_1=idx_1, idx_2=idx_2, combiner=combiner)
+        costs, _ = patient.cost_model.evaluate(PlanSet(plans))
+        return costs, plans
+
+    if method == 'grid':
+        ws = np.linspace(0, 1, n_steps)
+        costs, plans = evaluate(ws)
+        n_evals = n_steps
+    elif method == 'golden':
+        seed_ws = np.linspace(0, 1, n_steps)
+        seed_costs, seed_plans = evaluate(seed_ws)
+        evaluated = dict(zip(seed_ws, zip(seed_costs, seed_plans)))
+
+        def cost(w):
+            costs, plans = evaluate(np.array([w]))
+            evaluated[w] = (costs[0], plans[0])
+            return costs[0]
+
+        n_evals = n_steps
+        for lo, hi in grid_brackets(seed_ws, seed_costs, n_brackets=n_brackets):
+            n_evals += golden_section_search(cost, lo, hi, tol=tol)[2]
+        ws = np.array(sorted(evaluated))
+        costs = np.array([evaluated[w][0] for w in ws])
+        plans = [evaluated[w][1] for w in ws]
+    else:
+        raise ValueError(f"Unknown method {method}, use 'grid' or 'golden'.")
 
-    costs = np.asarray(costs)
     opt_idx = np.argmin(costs)
-    opt_cost = costs[opt_idx]
-    opt_w = ws[opt_idx]
-    opt_dvh = plans[opt_idx]
-    if full_output: return ws, costs, plans
-    else: 
-        return opt_w, opt_cost, opt_dvh
+    output = (ws, costs, plans) if full_output else (ws[opt_idx], costs[opt_idx], plans[opt_idx])
+    if return_evals:
+        return output + (n_evals,)
+    return output
 
 def plot_weight_search(patient, gaze_angle_key_1, gaze_angle_key_2, n_steps=10):
     n_plots = len(patient.roi_names)
@@ -387,33 +699,67 @@ def plot_gaze_combo_heatmap(costs, beam_weights, gaze_angle_keys, ax):
     ax.add_patch(rect)
     return cmap, norm
 
-def calculate_gaze_combos(patient, n_steps=10):
+def calculate_gaze_combos(patient, n_steps=10, workers=1):
+    """
+    Best beam weight, cost and plan of every pair of gaze angles (upper triangle, 
+    including pairs of an angle with itself). All pairs are swept in chunks, optionally 
+    in `workers` processes, every chunk is scored at once and only the best plan of 
+    every pair is kept.
+    """
     gaze_angle_keys = patient.gaze_angle_keys
     print("Calculating all gaze angle combinations...")
     n = len(gaze_angle_keys)
-    all_costs= []
-    all_beam_weights = []
-    all_plans = []
-
-    for i, angle_1 in enumerate(gaze_angle_keys):
-        cost_row = [np.inf]*i
-        weight_row = [np.inf]*i
-        plan_row = [False]*i
-        for j, angle_2 in enumerate(gaze_angle_keys[i:]):
-            opt_w, opt_cost, opt_plan = find_best_beam_weight(
-                patient, 
-                gaze_angle_key_1=angle_1, 
-                gaze_angle_key_2=angle_2)
-
-            cost_row.append(opt_cost)
-            weight_row.append(opt_w)
-            plan_row.append(opt_plan)
-
-        all_costs.append(cost_row)
-        all_beam_weights.append(weight_row)
-        all_plans.append(plan_row)
-        print_progress_bar(i+1, n)
-    return np.asarray(all_beam_weights), np.asarray(all_costs), np.asarray(all_plans)
+    ws = np.linspace(0, 1, n_steps)
+    idx_1, idx_2 = np.triu_indices(n)
+
+    combiner = TwoBeamCombiner(patient)
+    row_1, row_2, row_w = combiner.pair_rows(weights=ws, idx_1=idx_1, idx_2=idx_2)
+    angle_keys = combiner.angle_keys
+    sweep = combiner if workers <= 1 else ParallelSweep(combiner, workers=workers)
+
+    best_costs = np.full(len(idx_1), np.inf)
+    best_weights = np.full(len(idx_1), np.inf)
+    best_plans = np.full(len(idx_1), False, dtype=object)
+    for rows, dvh_dose, dvh_volume in sweep.iter_dvhs(row_1, row_2, row_w):
+        chunk_rows = np.arange(rows.start, rows.stop)
+        plans = plans_from_dvhs(
+            patient=patient,
+            dvh_dose=dvh_dose,
+            dvh_volume=dvh_volume,
+            angle_keys=[angle_keys[i] for i in row_1[rows]],
+            angle_keys_2=[angle_keys[i] for i in row_2[rows]],
+            beam_weights=row_w[rows]
+        )
+        costs, _ = patient.cost_model.evaluate(PlanSet(plans, dvh_dose=dvh_dose, dvh_volume=dvh_volume))
+
+        #lowest cost row of every pair in the chunk, pairs may be split between chunks.
+        #Ties keep the first weight, like argmin.
+        pairs = chunk_rows // n_steps
+        order = np.lexsort((costs, pairs))
+        first = order[np.r_[True, pairs[order][1:] != pairs[order][:-1]]]
+        first = first[costs[first] < best_costs[pairs[first]]]
+
+        best_costs[pairs[first]] = costs[first]
+        best_weights[pairs[first]] = row_w[chunk_rows[first]]
+        for k in first:
+            #copy the DVHs so the plan does not keep the whole chunk alive
+            best_plans[pairs[k]] = plans_from_dvhs(
+                patient=patient,
+                dvh_dose=dvh_dose[[k]],
+                dvh_volume=dvh_volume[[k]],
+                angle_keys=[plans[k].angle_key],
+                angle_keys_2=[plans[k].angle_key_2],
+                beam_weights=[plans[k].beam_weight]
+            )[0]
+        print_progress_bar(rows.stop, len(row_w))
+
+    all_costs = np.full((n, n), np.inf)
+    all_beam_weights = np.full((n, n), np.inf)
+    all_plans = np.full((n, n), False, dtype=object)
+    all_costs[idx_1, idx_2] = best_costs
+    all_beam_weights[idx_1, idx_2] = best_weights
+    all_plans[idx_1, idx_2] = best_plans
+    return all_beam_weights, all_costs, all_plans
 
 def plot_all_gaze_combos(patient, n_steps=10):
     gaze_angle_keys = patient.gaze_angle_keys
@@ -437,12 +783,8 @@ def plot_all_gaze_combos(patient, n_steps=10):
     angle_1 = opt_plan.angle_key
     angle_2 = opt_plan.angle_key_2
     
-    with h5py.File(patient.h5_file_path, "r") as h5_file:
-            dose_1 = h5_file[angle_1][:]
-            dose_2 = h5_file[angle_2][:]
-        
-    plan_1 = TreatmentPlan(patient=patient, angle_key=angle_1, dose=dose_1)
-    plan_2 = TreatmentPlan(patient=patient, angle_key=angle_2, dose=dose_2)
+    plan_1 = patient.gaze_angle_dvhs[angle_1]
+    plan_2 = patient.gaze_angle_dvhs[angle_2]
     print(plans)
     for roi_name, ax in zip(plan_1.roi_names, axes[1:]):
         for w, cost, plan in zip(beam_weights.flatten(), costs.flatten(), plans.flatten()):
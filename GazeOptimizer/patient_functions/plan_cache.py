@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Sequence
+from typing import Dict, List
+import numpy as np
+
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+from GazeOptimizer.patient_functions.patient import TreatmentPlan
+
+#bump whenever the on-disk layout changes, old caches are then ignored
+CACHE_VERSION = 1
+
+MANIFEST = 'manifest.json'
+ARRAYS = ['dvh_dose', 'dvh_volume', 'angle_idx_1', 'angle_idx_2', 'beam_weights', 'metrics', 'auc']
+
+
+class CachedPlans(Sequence):
+    """
+    Plans of a cached plan set. A plan is only built when it is accessed, e.g. when it is clicked
+    or highlighted, its DVHs are views of the memory-mapped arrays.
+    """
+    def __init__(
+        self,
+        patient,
+        dvh_dose: np.ndarray,
+        dvh_volume: np.ndarray,
+        angle_keys: List[str],
+        angle_idx: np.ndarray,
+        beam_weight: np.ndarray
+        ):
+        """
+        Parameters:
+        patient (Patient): Patient of the plans.
+        dvh_dose (np.ndarray): Bin center doses (plans x ROIs x bins), or a single row shared by all plans.
+        dvh_volume (np.ndarray): Cumulative volumes (plans x ROIs x bins).
+        angle_keys (List[str]): Gaze angle keys `angle_idx` refers to.
+        angle_idx (np.ndarray): Gaze angle index of both beams (plans x 2), -1 for single beam plans.
+        beam_weight (np.ndarray): Weight of the first beam, nan for single beam plans.
+        """
+        self.patient = patient
+        self.dvh_dose = dvh_dose
+        self.dvh_volume = dvh_volume
+        self.angle_keys = angle_keys
+        self.angle_idx = angle_idx
+        self.beam_weight = beam_weight
+        self.plans = {}
+
+    def __len__(self):
+        return len(self.angle_idx)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f'Plan {index} out of range for {len(self)} plans.')
+
+        if index not in self.plans:
+            idx_1, idx_2 = self.angle_idx[index]
+            self.plans[index] = TreatmentPlan(
+                patient=self.patient,
+                angle_key=self.angle_keys[idx_1],
+                angle_key_2=None if idx_2 < 0 else self.angle_keys[idx_2],
+                beam_weight=None if idx_2 < 0 else float(self.beam_weight[index]),
+                dvh_dose=self.dvh_dose[index if len(self.dvh_dose) > 1 else 0],
+                dvh_volume=self.dvh_volume[index]
+            )
+        return self.plans[index]
+
+
+def file_digest(path: str, cache_dir: str) -> str:
+    """
+    SHA-1 of a file's content. The digest is remembered in `cache_dir` together with the
+    file's size and modification time, so unchanged files are only hashed once.
+    """
+    stat = os.stat(path)
+    digests_path = os.path.join(cache_dir, 'digests.json')
+    digests = {}
+    if os.path.exists(digests_path):
+        with open(digests_path) as f:
+            digests = json.load(f)
+
+    key = os.path.abspath(path)
+    entry = digests.get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha1']
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            sha1.update(block)
+    digests[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(digests_path, 'w') as f:
+        json.dump(digests, f, indent=1)
+    return digests[key]['sha1']
+
+def cache_inputs(patient, n_steps: int, cache_dir: str) -> Dict:
+    """
+    Everything the cached plan set depends on.
+    """
+    return {
+        'version': CACHE_VERSION,
+        'h5_sha1': file_digest(patient.h5_file_path, cache_dir),
+        'n_steps': int(n_steps),
+        'bins': int(patient.num_dvh_bins),
+        'dvh_edges': patient.dvh_edges,
+        'roi_names': list(patient.roi_names),
+        'weights': str(patient.weights),
+    }
+
+def cache_path(patient, n_steps: int, cache_dir: str) -> str:
+    """
+    Directory of the cache for a patient and its inputs, named by a hash of the inputs.
+    """
+    inputs = cache_inputs(patient, n_steps, cache_dir)
+    key = hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, str(patient.patient_id), key)
+
+def save_plan_cache(
+    plan_set: PlanSet,
+    n_steps: int,
+    cache_dir: str
+    ) -> str:
+    """
+    Write DVHs, metric matrix and plan metadata of a plan set as .npy files plus a JSON manifest.
+    The directory is written under a temporary name and renamed, so readers never see partial caches.
+    Returns:
+    str: Cache directory.
+    """
+    patient = plan_set.patient
+    if any(plan.n_beams > 2 for plan in plan_set):
+        raise ValueError("The plan cache only stores plans with up to two beams.")
+    path = cache_path(patient, n_steps, cache_dir)
+    angle_idx, beam_weights = plan_set.beams()
+    cost_model = patient.cost_model
+
+    arrays = {
+        'dvh_volume': np.stack([plan_set.volumes[roi] for roi in plan_set.roi_names], axis=1),
+        'angle_idx_1': angle_idx[:, 0],
+        'angle_idx_2': angle_idx[:, 1],
+        'beam_weights': beam_weights[:, 0],
+        'metrics': cost_model.metric_matrix(plan_set),
+        'auc': cost_model.auc_matrix(plan_set),
+    }
+
+    #single dose axis row if every roi's axis is shared by all plans
+    shared = all(plan_set.dose[roi].shape[0] == 1 for roi in plan_set.roi_names)
+    n_rows = 1 if shared else len(plan_set)
+    arrays['dvh_dose'] = np.stack([np.broadcast_to(plan_set.dose[roi], (n_rows, plan_set.dose[roi].shape[1])) for roi in plan_set.roi_names], axis=1)
+
+    manifest = cache_inputs(patient, n_steps, cache_dir)
+    manifest.update({
+        'patient_id': str(patient.patient_id),
+        'h5_file_path': patient.h5_file_path,
+        'angle_keys': list(patient.gaze_angle_keys),
+        'n_plans': len(plan_set),
+        'metric_terms': [[roi, str(t), float(v)] for roi, t, v in zip([cost_model.roi_names[i] for i in cost_model.roi_index], cost_model.metric_types, cost_model.thresholds)],
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+def load_plan_cache(
+    patient,
+    n_steps: int,
+    cache_dir: str
+    ) -> PlanSet:
+    """
+    Open the cached plan set of a patient with memory-mapped arrays.
+    Returns:
+    PlanSet: The cached plan set, or None if no cache matches the current inputs.
+    """
+    path = cache_path(patient, n_steps, cache_dir)
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest['version'] != CACHE_VERSION:
+        return None
+
+    arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+    angle_idx = np.stack([arrays['angle_idx_1'], arrays['angle_idx_2']], axis=1)
+    beam_weights = np.stack([arrays['beam_weights'], 1 - arrays['beam_weights']], axis=1)
+    plans = CachedPlans(
+        patient=patient,
+        dvh_dose=arrays['dvh_dose'],
+        dvh_volume=arrays['dvh_volume'],
+        angle_keys=manifest['angle_keys'],
+        angle_idx=angle_idx,
+        beam_weight=arrays['beam_weights']
+    )
+    plan_set = PlanSet(plans, dvh_dose=arrays['dvh_dose'], dvh_volume=arrays['dvh_volume'], beams=(angle_idx, beam_weights))
+
+    #precomputed metrics are used as memoized values
+    for k, (roi, metric_type, metric_value) in enumerate(manifest['metric_terms']):
+        plan_set.memo.put((roi, metric_type, float(metric_value)), arrays['metrics'][:, k])
+    for i, roi in enumerate(manifest['roi_names']):
+        plan_set.memo.put((roi, 'AUC'), arrays['auc'][:, i])
+
+    return plan_set
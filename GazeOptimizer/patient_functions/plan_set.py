@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import List, Tuple
+import numpy as np
+
+from GazeOptimizer.patient_functions.memo import MemoCache
+from GazeOptimizer.patient_functions.pareto import pareto_front
+
+#maximum number of memoized metric vectors per plan set
+PLAN_SET_MEMO_SIZE = 256
+
+
+def interp_rows(x, xp, fp):
+    """
+    Row-wise `np.interp` for many monotone curves at once.
+    Parameters:
+    x (float or np.ndarray): Point to evaluate, scalar or one value per row.
+    xp (np.ndarray): Non-decreasing x coordinates (rows x n), or (1 x n) if shared by all rows.
+    fp (np.ndarray): y coordinates (rows x n).
+    Returns:
+    np.ndarray: Interpolated value of every row, clamped to the end values like `np.interp`.
+    """
+    n_rows, n = fp.shape
+    if n_rows == 0:
+        return np.empty(0)
+    x = np.broadcast_to(np.asarray(x, dtype=float), (n_rows,))
+
+    #last index with xp <= x, like the binary search in np.interp
+    if xp.shape[0] == 1 and np.all(x == x[0]):
+        j = np.full(n_rows, np.searchsorted(xp[0], x[0], side='right') - 1)
+    else:
+        j = np.sum(xp <= x[:, None], axis=1) - 1
+    rows = np.arange(n_rows)
+    xp_rows = np.broadcast_to(xp, fp.shape)
+
+    j_lo = np.clip(j, 0, n-2)
+    x_lo, x_hi = xp_rows[rows, j_lo], xp_rows[rows, j_lo+1]
+    f_lo, f_hi = fp[rows, j_lo], fp[rows, j_lo+1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = f_lo + (f_hi - f_lo) / (x_hi - x_lo) * (x - x_lo)
+
+    #clamp outside the range of xp
+    values = np.where(j < 0, fp[:, 0], values)
+    values = np.where(j >= n-1, fp[:, -1], values)
+    return values
+
+def volume_at_dose(dose, volumes, x):
+    """
+    Vx of many DVHs: volume (%) receiving at least dose x.
+    dose (1 x bins or plans x bins) must be ascending, volumes are (plans x bins).
+    """
+    return interp_rows(x, dose, volumes)
+
+def dose_at_volume(dose, volumes, x):
+    """
+    Dx of many DVHs: dose covering volume x (%).
+    x is clipped to the volume range of each DVH, dose (1 x bins or plans x bins) must be ascending.
+    """
+    dose = np.broadcast_to(dose, volumes.shape)
+    xp, fp = volumes[:, ::-1], dose[:, ::-1]
+    x = np.clip(x, xp[:, 0], xp[:, -1])
+    return interp_rows(x, xp, fp)
+
+def dvh_auc(dose, volumes):
+    """
+    Area under many DVHs.
+    """
+    return np.trapz(y=volumes, x=np.broadcast_to(dose, volumes.shape), axis=1)
+
+
+class PlanSet:
+    """
+    Set of treatment plans with their DVHs stacked per ROI (plans x bins), so metrics
+    are evaluated for all plans at once, e.g. `plan_set.metric('Cornea', 'D', 20)`.
+    """
+    def __init__(
+        self,
+        plans: List,
+        dvh_dose: np.ndarray=None,
+        dvh_volume: np.ndarray=None,
+        beams: Tuple[np.ndarray, np.ndarray]=None
+        ):
+        """
+        Parameters:
+        plans (List[TreatmentPlan]): Plans of the set, their position is their index in the set.
+            Any sequence is kept as it is, e.g. one building plans on first access.
+        dvh_dose, dvh_volume (np.ndarray, optional): Batched DVHs of the plans (plans x ROIs x bins),
+            `dvh_dose` may have a single row shared by all plans. Stacked from the plans' DVHs if not given.
+        beams (Tuple[np.ndarray], optional): Gaze angles and weights of the first two beams of every
+            plan, see `beams`. Collected from the plans if not given.
+        """
+        self.plans = plans if isinstance(plans, Sequence) else list(plans)
+        self.patient = getattr(self.plans, 'patient', None) or self.plans[0].patient
+        self.roi_names = list(self.patient.roi_names)
+        self._index = None
+        self._beams = beams
+
+        if dvh_dose is None or dvh_volume is None:
+            dvh_dose = np.stack([[plan.dvhs[roi].dose for roi in self.roi_names] for plan in self.plans])
+            dvh_volume = np.stack([[plan.dvhs[roi].volume for roi in self.roi_names] for plan in self.plans])
+
+        #keep a single dose axis per roi when all plans share it
+        self.dose = {}
+        self.volumes = {}
+        for i, roi in enumerate(self.roi_names):
+            dose = dvh_dose[:, i]
+            self.dose[roi] = dose[:1] if np.all(dose == dose[0]) else dose
+            self.volumes[roi] = dvh_volume[:, i]
+
+        self.memo = MemoCache(maxsize=PLAN_SET_MEMO_SIZE)
+
+    @property
+    def index(self):
+        """
+        Position of every plan in the set, built on first use.
+        """
+        if self._index is None:
+            self._index = {plan: i for i, plan in enumerate(self.plans)}
+        return self._index
+
+    def beams(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Gaze angles and weights of the first two beams of every plan.
+        Returns:
+        Tuple[np.ndarray]: Gaze angle index in `patient.gaze_angle_keys` (plans x 2, -1 for a missing
+            second beam) and beam weights (plans x 2, nan for single beam plans).
+        """
+        if self._beams is None:
+            angle_ids = {angle_key: i for i, angle_key in enumerate(self.patient.gaze_angle_keys)}
+            angle_idx = np.full((len(self), 2), -1, dtype=int)
+            beam_weights = np.full((len(self), 2), np.nan)
+            for plan_id, plan in enumerate(self.plans):
+                angle_keys = plan.angle_keys[:2]
+                angle_idx[plan_id, :len(angle_keys)] = [angle_ids[angle_key] for angle_key in angle_keys]
+                if plan.n_beams > 1:
+                    beam_weights[plan_id] = plan.beam_weights[:2]
+            self._beams = angle_idx, beam_weights
+        return self._beams
+
+    def __str__(self):
+        return f'PlanSet for Patient {self.patient.patient_id} with {len(self)} plans'
+
+    def __len__(self):
+        return len(self.plans)
+
+    def __iter__(self):
+        return iter(self.plans)
+
+    def __getitem__(self, index):
+        return self.plans[index]
+
+    def indices(self, plans: List) -> np.ndarray:
+        """
+        Positions of plans within the set. Arrays of plan IDs (positions) or boolean masks are returned as they are.
+        """
+        if isinstance(plans, np.ndarray):
+            return plans
+        return np.array([self.index[plan] for plan in plans], dtype=int)
+
+    def memo_nbytes(self) -> int:
+        """
+        Memory of the memoized values of the set, e.g. metric columns and costs.
+        """
+        values = [value if isinstance(value, tuple) else (value,) for value in self.memo.entries.values()]
+        return sum(array.nbytes for value in values for array in value)
+
+    def metric(
+        self,
+        roi: str,
+        metric_type: str,
+        metric_value: float,
+        plans: List=None
+        ) -> np.ndarray:
+        """
+        Dx ('D') or Vx ('V') of a ROI for every plan of the set.
+        Parameters:
+        roi (str): ROI to evaluate.
+        metric_type (str): 'D' for dose at volume, 'V' for volume at dose.
+        metric_value (float): Volume (%) for 'D', dose (Gy) for 'V'.
+        plans (List[TreatmentPlan] or np.ndarray, optional): Only evaluate these plans of the set, 
+            given as plans, plan IDs or a boolean mask.
+        Returns:
+        np.ndarray: Metric value per plan.
+        """
+        if metric_type not in ['D', 'V']:
+            raise ValueError(f"Metric type must be 'D' or 'V', not {metric_type}.")
+        values = self.memo.get_or_compute(
+            (roi, metric_type, float(metric_value)),
+            lambda: self._metric(roi, metric_type, metric_value)
+        )
+        return values if plans is None else values[self.indices(plans)]
+
+    def _metric(self, roi, metric_type, metric_value):
+        dose, volumes = self.dose[roi], self.volumes[roi]
+        if metric_type == 'D':
+            return dose_at_volume(dose, volumes, metric_value)
+        return volume_at_dose(dose, volumes, metric_value)
+
+    def auc(
+        self,
+        roi: str,
+        plans: List=None
+        ) -> np.ndarray:
+        """
+        Area under the DVH of a ROI for every plan of the set.
+        """
+        values = self.memo.get_or_compute(
+            (roi, 'AUC'),
+            lambda: dvh_auc(self.dose[roi], self.volumes[roi])
+        )
+        return values if plans is None else values[self.indices(plans)]
+
+    def pareto_front(
+        self,
+        metrics: List[Tuple[str, str, float]],
+        plans: List=None
+        ) -> np.ndarray:
+        """
+        Plans not dominated by any other plan in a set of metrics, all of which are minimized.
+        Parameters:
+        metrics (List[Tuple]): (roi, metric type, metric value) of every objective.
+        plans (List[TreatmentPlan] or np.ndarray, optional): Only compare these plans of the set.
+        Returns:
+        np.ndarray: Boolean mask of the Pareto-optimal plans among `plans`.
+        """
+        values = np.stack([
+            self.metric(roi=roi, metric_type=metric_type, metric_value=metric_value, plans=plans)
+            for roi, metric_type, metric_value in metrics
+        ], axis=1)
+        return pareto_front(values)
+
+    def invalidate(self):
+        """
+        Drop all memoized metric vectors, needed if the DVHs of the set are changed.
+        """
+        self.memo.clear()
@@ -6,6 +6,8 @@ import numpy as np
 import seaborn as sns
 import os
 
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+
 
 def compare_contributions(
     plans: List[TreatmentPlan], 
@@ -30,14 +32,16 @@ def compare_contributions(
     width = 0.75/n_plans
     
     
+    #cost contributions of all plans at once (plans x terms)
+    cost_model = plans[0].patient.cost_model
+    _, contributions = cost_model.evaluate(PlanSet(plans))
+    labels = cost_model.term_names
+    x = np.arange(len(labels))  # the label locations
+
     #create bars for each gaze angle
     for i, plan in enumerate(plans):
         offset=i*width - width*n_plans/2 + width/2
-        contributions = plan.calculate_contributions()
-        labels = contributions.keys()
-        sizes = [float(contributions[label]) for label in labels]
-        x = np.arange(len(labels))  # the label locations
-        rects = ax.bar(x + offset, sizes, width, label=plan.name)
+        rects = ax.bar(x + offset, contributions[i], width, label=plan.name)
 
     # Add some text for labels, title and custom x-axis tick labels, etc.
     ax.set_ylabel('Cost Contribution')
@@ -81,10 +85,11 @@ def single_gaze_plot(
 
     #determine costs based on metric
     if metric == 'total_cost':
-        costs = [plan.calculate_cost() for plan in plans]
+        costs, _ = plans[0].patient.cost_model.evaluate(PlanSet(plans))
     
     elif metric == 'volume_term':
-        costs = [plan.calculate_volume_term() for plan in plans]
+        _, contributions = plans[0].patient.cost_model.evaluate(PlanSet(plans))
+        costs = contributions[:, -1]
 
     else: 
         roi = metric.split('_')[1]
@@ -242,7 +247,7 @@ def dvh_scatter_plot(
         single_gaze_plot(metric='total_cost', plans=plans, ax=ax_scatter)
 
     #create colormap and scale with min and max of cost
-    costs = np.array([plan.calculate_cost() for plan in plans])
+    costs, _ = plans[0].patient.cost_model.evaluate(PlanSet(plans))
     cmap = plt.cm.viridis
     colors = cmap((costs - costs.min()) / (costs.max() - costs.min()))
 
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import time
+from typing import Callable, List, Tuple
+import numpy as np
+
+from GazeOptimizer.patient_functions.patient import Patient, TreatmentPlan, build_two_beam_plans
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+from GazeOptimizer.patient_functions.plan_cache import save_plan_cache
+from GazeOptimizer.patient_functions.helpers import print_progress_bar
+
+
+def find_all_gaze_combos(
+    patient: Patient,
+    n_steps: int=10,
+    progress: Callable=None,
+    workers: int=1
+    ) -> List[TreatmentPlan]:
+    """
+    All single beam plans followed by all two beam plans, ordered by pair and weight.
+    Parameters:
+    patient (Patient): Patient to combine gaze angles for.
+    n_steps (int): Beam weights are np.linspace(0, 1, n_steps, endpoint=False)[1:].
+    progress (callable, optional): Called with (two beam plans done, total) after every chunk.
+    workers (int): Number of processes sweeping the two beam plans.
+    Returns:
+    List[TreatmentPlan]: All plans.
+    """
+    plans = list(patient.gaze_angle_dvhs.load_all().values())
+    plans += build_two_beam_plans(
+        patient=patient,
+        weights=np.linspace(0, 1, n_steps, endpoint=False)[1:],
+        progress=progress,
+        workers=workers
+    )
+    return plans
+
+def precompute_plan_set(
+    patient: Patient,
+    n_steps: int,
+    cache_dir: str,
+    workers: int=1,
+    verbose: bool=True,
+    progress: Callable=None,
+    on_step: Callable=None
+    ) -> Tuple[PlanSet, str]:
+    """
+    Build all plans of a patient and write them to the plan cache, printing progress and timings.
+    progress (callable, optional): Called with (two beam plans done, total) after every chunk,
+        replaces the progress bar.
+    on_step (callable, optional): Called with the name of every step before it starts.
+    Returns:
+    Tuple[PlanSet, str]: The plan set and its cache directory.
+    """
+    timings = {}
+    if on_step is None:
+        on_step = lambda step: None
+
+    on_step('read doses')
+    start = time.perf_counter()
+    patient.dose_store.load(patient.gaze_angle_keys)
+    timings['read doses'] = time.perf_counter() - start
+
+    on_step('build plans')
+    start = time.perf_counter()
+    if progress is None and verbose:
+        progress = lambda done, total: print_progress_bar(done, total, prefix='Two beam plans')
+    plan_set = PlanSet(find_all_gaze_combos(patient=patient, n_steps=n_steps, progress=progress, workers=workers))
+    timings['build plans'] = time.perf_counter() - start
+
+    on_step('write cache')
+    start = time.perf_counter()
+    path = save_plan_cache(plan_set=plan_set, n_steps=n_steps, cache_dir=cache_dir)
+    timings['write cache'] = time.perf_counter() - start
+
+    if verbose:
+        for step, seconds in timings.items():
+            print(f'{step:>12}: {seconds:8.2f} s')
+        print(f'{len(plan_set)} plans ({len(plan_set)/timings["build plans"]:.0f} plans/s), cache: {path}')
+    return plan_set, path
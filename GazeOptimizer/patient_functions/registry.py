@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class PatientRegistry:
+    """
+    Least-recently-used registry of loaded patients, bounded by memory.
+
+    `get` returns a loaded patient or loads it with `load(patient_id)`. Loaded entries report
+    their size with `nbytes()`, which may grow while they are used (e.g. lazily built indices),
+    so the bound is enforced on every access: least recently used patients are dropped until
+    all entries fit into `max_bytes`. The most recently used patient is always kept.
+    """
+    def __init__(
+        self,
+        load: Callable,
+        max_bytes: int
+        ):
+        """
+        Parameters:
+        load (Callable): Loads a patient by ID, the result must provide `nbytes()`.
+        max_bytes (int): Memory budget of all loaded patients in bytes.
+        """
+        self.load = load
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        return f'PatientRegistry with {len(self)} loaded patients, {self.nbytes() / 2**20:.1f}/{self.max_bytes / 2**20:.1f} MB, {self.hits} hits, {self.misses} misses'
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, patient_id):
+        return patient_id in self.entries
+
+    def get(self, patient_id: Hashable):
+        """
+        Loaded patient, loading it on a miss.
+        """
+        if patient_id in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(patient_id)
+        else:
+            self.misses += 1
+            self.entries[patient_id] = self.load(patient_id)
+        self.evict()
+        return self.entries[patient_id]
+
+    def nbytes(self) -> int:
+        return sum(entry.nbytes() for entry in self.entries.values())
+
+    def evict(self):
+        """
+        Drop least recently used patients until the rest fits into the memory budget.
+        """
+        while len(self.entries) > 1 and self.nbytes() > self.max_bytes:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self), 'nbytes': self.nbytes(), 'max_bytes': self.max_bytes}
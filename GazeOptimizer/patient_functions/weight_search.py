@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+from typing import Callable, List, Tuple
+import numpy as np
+
+#1/phi, fraction of the bracket kept in every golden-section step
+INV_PHI = (np.sqrt(5) - 1) / 2
+
+
+def grid_brackets(
+    xs: np.ndarray,
+    fs: np.ndarray,
+    n_brackets: int=2
+    ) -> List[Tuple[float, float]]:
+    """
+    Intervals between the neighbours of the lowest local minima of a function on a grid,
+    lowest first. A minimum of the function lies inside such an interval if the function is
+    unimodal between the neighbours, minima between other grid points are missed.
+    """
+    fs = np.asarray(fs)
+    padded = np.concatenate([[np.inf], fs, [np.inf]])
+    minima = np.flatnonzero((fs <= padded[:-2]) & (fs <= padded[2:]))
+    minima = minima[np.argsort(fs[minima], kind='stable')][:n_brackets]
+    return [(xs[max(i-1, 0)], xs[min(i+1, len(xs)-1)]) for i in minima]
+
+def golden_section_search(
+    f: Callable[[float], float],
+    lo: float,
+    hi: float,
+    tol: float=1e-3,
+    max_evals: int=100
+    ) -> Tuple[float, float, int]:
+    """
+    Minimize a scalar function on [lo, hi] by golden-section search.
+    Parameters:
+    f (callable): Function to minimize.
+    lo, hi (float): Bracket of the minimum.
+    tol (float): Width of the final bracket.
+    max_evals (int): Maximum number of evaluations of f.
+    Returns:
+    Tuple[float, float, int]: Best x, f(x) and the number of evaluations of f.
+    """
+    a, b = lo, hi
+    c, d = b - INV_PHI*(b-a), a + INV_PHI*(b-a)
+    fc, fd = f(c), f(d)
+    n_evals = 2
+    while b - a > tol and n_evals < max_evals:
+        if fc <= fd:
+            b, d, fd = d, c, fc
+            c = b - INV_PHI*(b-a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + INV_PHI*(b-a)
+            fd = f(d)
+        n_evals += 1
+    return (c, fc, n_evals) if fc <= fd else (d, fd, n_evals)
@@ -1,12 +1,15 @@
 import numpy as np
 import dash
-from dash import html, dcc, callback_context
+from dash import html, dcc, ctx, no_update
+from dash.exceptions import PreventUpdate
 from dash.dependencies import Input, Output, State, MATCH, ALL
+from flask import jsonify, abort
 import plotly.graph_objs as go
 import matplotlib as mpl
 
 from helpers import *
 from config import *
+from GazeOptimizer.patient_functions.jobs import JobQueue, DONE, FINAL_STATES
 
 
 # ============================================================
@@ -19,12 +22,65 @@ m_types = [ESPENSEN_METRICS[roi][0] for roi in ROI_NAMES]
 m_vals = [ESPENSEN_METRICS[roi][1] for roi in ROI_NAMES]
 ESPENSEN_METRICS = construct_metrics(m_types, m_vals)
 
+#the configured patient if it has a plan cache, otherwise the first one that has. Without any
+#the app starts with empty figures until a patient is precomputed.
+START_PATIENTS = cached_patients()
+START_PATIENT_ID = PATIENT_ID if PATIENT_ID in START_PATIENTS else next(iter(START_PATIENTS), None)
+if START_PATIENT_ID is None:
+    START_FIGURES = empty_figures("No precomputed patients, select a new patient and press Precompute.")
+else:
+    START_FIGURES = start_figures(REGISTRY.get(START_PATIENT_ID), metrics=ESPENSEN_METRICS)
+
+#precompute jobs of new patients, run in the background
+JOB_QUEUE = JobQueue(jobs_dir=JOBS_DIR)
+
+def submit_precompute(patient_id):
+    return JOB_QUEUE.submit(
+        patient_id=patient_id,
+        h5_file_path=h5_file_path(patient_id),
+        n_steps=N_STEPS,
+        cache_dir=CACHE_DIR,
+        dvh_edges=DVH_EDGES
+    )
+
 app.layout = html.Div([
 
     dcc.Store(id="filters", data={}),
-    dcc.Store(id="last-click", data=[None for _ in ROI_NAMES]),
     dcc.Store(id="highlight-plans", data={}),
 
+    dcc.Store(id="job-id", storage_type="local"), #survives page reloads
+    dcc.Interval(id="job-poll", interval=1000, disabled=True),
+
+    html.Div(
+        style={"display": "flex", "gap": "10px", "alignItems": "center", "marginBottom": "10px"},
+        children=[
+            dcc.Dropdown(
+                id="patient-select",
+                options=START_PATIENTS,
+                value=START_PATIENT_ID,
+                clearable=False,
+                style={"width": "200px"}
+            ),
+            dcc.Dropdown(
+                id="new-patient",
+                options=[],
+                placeholder="New patient",
+                style={"width": "200px"}
+            ),
+            html.Button("Precompute", id="precompute-button", n_clicks=0),
+            html.Button("Cancel", id="cancel-button", n_clicks=0),
+            html.Progress(id="job-progress", value="0", max="1", style={"width": "200px"}),
+            html.Span(id="job-status"),
+        ]
+    ),
+
+    dcc.Checklist(
+        id="pareto-toggle",
+        options=[{"label": " Pareto-optimal plans only", "value": "pareto"}],
+        value=[],
+        style={"marginBottom": "10px"}
+    ),
+
     html.Div(
         id="plots-container",
         style={
@@ -37,7 +93,7 @@ app.layout = html.Div([
             html.Div([
                 dcc.Graph(
                     id={"type": "roi-plot", "index": i},
-                    figure=make_dvh_figure(roi, plans=ALL_PLANS, metric=ESPENSEN_METRICS[i], highlight_plans=[])
+                    figure=START_FIGURES[i]
                 ),
                 html.Button(
                     "Clear Filter",
@@ -48,6 +104,7 @@ app.layout = html.Div([
                 dcc.Input(
                     id={"type": "metric-type", "index": i},
                     type='text',
+                    debounce=True,
                     placeholder='D/V',
                     style={
                         "marginLeft": "100px",
@@ -58,6 +115,7 @@ app.layout = html.Div([
                 dcc.Input(
                     id={"type": "metric-value", "index": i},
                     type='text',
+                    debounce=True,
                     placeholder='value',
                     style={"width": "50px"},
                     value=ESPENSEN_METRICS[i].metric_value if ESPENSEN_METRICS[i] is not None else None
@@ -96,60 +154,46 @@ app.layout = html.Div([
 # CALLBACK: CLICK TO SET FILTER
 # ============================================================
 
-# Update figures and filter store
+# Update filter store on clicks on DVHs, "Clear Filter" and "Apply", reset it for a new patient
 @app.callback(
-    Output({"type": "roi-plot", "index": ALL}, "figure"),
     Output("filters", "data"),
-    Output("last-click", "data"),
-    Output("highlight-plans", "data"),
     Output({'type': 'metric-max', 'index': ALL}, 'value'),
     Input({"type": "roi-plot", "index": ALL}, "clickData"),
     Input({"type": "clear-button", "index": ALL}, "n_clicks"),
     Input({"type": "apply-button", "index": ALL}, "n_clicks"),
+    Input("patient-select", "value"),
     State("filters", "data"),
-    State("last-click", "data"),
-    State("highlight-plans", "data"),
     State({'type': 'metric-type', 'index': ALL}, 'value'),
     State({'type': 'metric-value', 'index': ALL}, 'value'),
     State({'type': 'metric-max', 'index': ALL}, 'value'),
+    prevent_initial_call=True
 )
 
-def update(
+def update_filters(
     filter_clicks,
     clear_clicks,
     apply_clicks,
+    patient_id,
     filter_dict,
-    last_click,
-    highlight_plan_keys,
     metric_type_vals,
     metric_value_vals,
     metric_max_vals,
 ):  
-    metrics = construct_metrics(metric_type_vals, metric_value_vals)
-    ctx = callback_context
-    highlight_point = None
-
-    #avoid doing stuff when first loading page
-    if not ctx.triggered:
-        fig = update_figures(plans=ALL_PLANS, metrics=metrics, highlight_plans=[])
-        return fig, filter_dict, last_click, highlight_plan_keys, metric_max_vals
-    
-
+    if ctx.triggered_id == "patient-select":
+        return {}, [None for _ in ROI_NAMES]
 
-    #extract Roi Name and Point Data
-    roi = ROI_NAMES[ctx.triggered_id['index']]
-    
-    #create filter store
-    filter_dict = filter_dict or {}
-    
+    metrics = construct_metrics(metric_type_vals, metric_value_vals)
+    trigger_type, roi_idx = ctx.triggered_id['type'], ctx.triggered_id['index']
+    roi = ROI_NAMES[roi_idx]
+    old_filter_dict = filter_dict or {}
+    filter_dict = dict(old_filter_dict)
 
-    
-    #check if click on plots triggered callback
-    if ctx.triggered_id['type'] == 'roi-plot':
-        point = get_new_click(last_click=last_click, this_click=filter_clicks)["points"][0]
-        if "x" in point: filter_dict = add_filter(filter_dict=filter_dict, point=point, roi=roi)
-        elif "r" in point:
-            highlight_point = point
+    #clicks on gaze angles are highlights
+    if trigger_type == 'roi-plot':
+        point = filter_clicks[roi_idx]["points"][0]
+        if "x" not in point:
+            raise PreventUpdate
+        filter_dict = add_filter(filter_dict=filter_dict, point=point, roi=roi)
     
     #check if metric max was specified. if so, add/adjust filter
     if any(metric_max_vals):
@@ -160,28 +204,175 @@ def update(
         )
         
     #check if click on "Clear Filter"
-    if ctx.triggered_id['type'] == 'clear-button':
+    if trigger_type == 'clear-button':
         filter_dict = delete_filter(filter_dict=filter_dict, roi=roi)
-        roi_idx = ROI_NAMES.index(roi)
         metric_max_vals[roi_idx] = None            
-    
-    #update plans
-    new_plans = filter_plans(filter_dict=filter_dict, plans=ALL_PLANS)
 
-    if highlight_point is not None:
-        add_highlight(highlight_plan_keys=highlight_plan_keys, point=highlight_point)
+    #unchanged filters do not touch the figures
+    if filter_dict == old_filter_dict:
+        filter_dict = no_update
+    return filter_dict, metric_max_vals
+
+
+# ============================================================
+# CALLBACK: CLICK TO HIGHLIGHT PLAN
+# ============================================================
+
+@app.callback(
+    Output("highlight-plans", "data"),
+    Input({"type": "roi-plot", "index": ALL}, "clickData"),
+    Input("patient-select", "value"),
+    State("highlight-plans", "data"),
+    prevent_initial_call=True
+)
+
+def update_highlights(filter_clicks, patient_id, highlight_plan_keys):
+    if ctx.triggered_id == "patient-select":
+        return {}
+
+    point = filter_clicks[ctx.triggered_id['index']]["points"][0]
+    if "r" not in point:
+        raise PreventUpdate
+    add_highlight(REGISTRY.get(patient_id), highlight_plan_keys=highlight_plan_keys, point=point)
+    return highlight_plan_keys
 
-    highlight_plans = {plan: highlight_plan_keys[plan.angle_key] for plan in ALL_PLANS if plan.angle_key in highlight_plan_keys and not plan.angle_key_2}
+
+# ============================================================
+# CALLBACK: UPDATE FIGURES
+# ============================================================
+
+# Partial updates of only the changed traces: a new plan mask replaces the traces of all figures,
+# highlights only the highlight traces, a new metric redraws the figure of its ROI, a new patient all figures
+@app.callback(
+    Output({"type": "roi-plot", "index": ALL}, "figure"),
+    Input("patient-select", "value"),
+    Input("filters", "data"),
+    Input("pareto-toggle", "value"),
+    Input("highlight-plans", "data"),
+    Input({'type': 'metric-type', 'index': ALL}, 'value'),
+    Input({'type': 'metric-value', 'index': ALL}, 'value'),
+    prevent_initial_call=True
+)
+
+def update_plots(
+    patient_id,
+    filter_dict,
+    pareto_toggle,
+    highlight_plan_keys,
+    metric_type_vals,
+    metric_value_vals,
+):
+    #no patient to show yet
+    if patient_id is None:
+        raise PreventUpdate
+    data = REGISTRY.get(patient_id)
+    metrics = construct_metrics(metric_type_vals, metric_value_vals)
+    triggered = ctx.triggered_prop_ids.values()
+    pareto = "pareto" in (pareto_toggle or [])
+
+    #a new patient starts without filters and highlights
+    if "patient-select" in triggered:
+        return start_figures(data, metrics=metrics, pareto=pareto)
+
+    #ROIs with a new metric
+    recolor = {t['index'] for t in triggered if isinstance(t, dict)}
+
+    #update plans, only keep plans not dominated in the metrics of the plots
+    mask = filter_mask(data, filter_dict=filter_dict)
+    if pareto:
+        mask = pareto_mask(data, mask=mask, metrics=metrics)
+    new_mask = "filters" in triggered or "pareto-toggle" in triggered or (pareto and len(recolor) > 0)
+
+    highlight_ids = get_highlight_ids(data, highlight_plan_keys)
     #display message if no plans left
-    if len(new_plans) == 0:
+    if new_mask and not mask.any():
         print("No Plans left")
 
+    figures = []
+    for i, roi in enumerate(ROI_NAMES):
+        if i in recolor:
+            figures.append(make_dvh_figure(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metrics[i], filter_dict=filter_dict))
+        elif new_mask:
+            figures.append(patch_plans(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metrics[i], filter_dict=filter_dict))
+        elif "highlight-plans" in triggered:
+            figures.append(patch_highlights(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metrics[i]))
+        else:
+            figures.append(no_update)
+    return figures
+
+
+# ============================================================
+# CALLBACK: PRECOMPUTE JOBS
+# ============================================================
+
+# Submit and cancel precompute jobs of new patients, poll the running job and open its patient when it is done
+@app.callback(
+    Output("job-id", "data"),
+    Output("job-poll", "disabled"),
+    Output("job-progress", "value"),
+    Output("job-status", "children"),
+    Output("patient-select", "options"),
+    Output("patient-select", "value"),
+    Output("new-patient", "options"),
+    Input("precompute-button", "n_clicks"),
+    Input("cancel-button", "n_clicks"),
+    Input("job-poll", "n_intervals"),
+    State("job-id", "data"),
+    State("new-patient", "value"),
+)
+
+def update_job(precompute_clicks, cancel_clicks, n_intervals, job_id, new_patient):
+    trigger = ctx.triggered_id
+    cached = cached_patients()
+    patient_options = no_update if trigger == "job-poll" else cached
+    new_options = [patient_id for patient_id in available_patients() if patient_id not in cached]
+
+    if trigger == "precompute-button":
+        if not new_patient:
+            raise PreventUpdate
+        job_id = submit_precompute(new_patient)
+    elif trigger == "cancel-button" and job_id:
+        JOB_QUEUE.cancel(job_id)
+
+    try:
+        job = JOB_QUEUE.status(job_id) if job_id else None
+    except (OSError, ValueError):
+        job = None
+    if job is None:
+        return None, True, "0", "", patient_options, no_update, new_options
+
+    #the patient of a finished job is opened once, by the poll that sees it finish or by the
+    #page load after it finished while the page was closed
+    finished = job['state'] in FINAL_STATES
+    seen = trigger in ["job-poll", None]
+    patient_value = no_update
+    if job['state'] == DONE and seen:
+        patient_options, patient_value = cached, job['patient_id']
+    return (
+        None if finished and seen else job_id,
+        finished,
+        str(job['progress']),
+        job_status_text(job),
+        patient_options,
+        patient_value,
+        new_options,
+    )
+
+
+# ============================================================
+# STATUS API
+# ============================================================
+
+@app.server.route("/jobs")
+def list_jobs():
+    return jsonify(JOB_QUEUE.jobs())
 
-    #update figures and add markers from filter_dict
-    fig = update_figures(plans=new_plans, metrics=metrics, highlight_plans=highlight_plans)
-    fig = add_filter_marker(fig=fig, filter_dict=filter_dict)
-    #print(highlight_plan_keys)
-    return fig, filter_dict, filter_clicks, highlight_plan_keys, metric_max_vals
+@app.server.route("/jobs/<job_id>")
+def job_status(job_id):
+    try:
+        return jsonify(JOB_QUEUE.status(job_id))
+    except (OSError, ValueError):
+        abort(404)
 
 
 # ============================================================
@@ -0,0 +1,241 @@
+"""
+Offline benchmarks of the hot paths on synthetic patients: DVHs, plan construction, the two
+beam sweep, filtering and building the app's figures and updates.
+
+    python benchmark.py --scales small medium --output benchmark.json
+    python benchmark.py --baseline benchmark.json
+
+Every benchmark reports the best and median wall time of its repeats, the peak memory of one
+extra traced run and its throughput (plans, DVHs or figures per second).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import h5py
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+from helpers import *
+from config import *
+from GazeOptimizer.patient_functions.helpers import cumulative_dvh
+from GazeOptimizer.patient_functions.filter_index import FilterMasks
+from GazeOptimizer.patient_functions.precompute import find_all_gaze_combos, precompute_plan_set
+
+#synthetic patients: gaze angles (1 + 8 per ring of polar angles), ROI voxels and beam weight steps
+SCALES = {
+    'small': {'n_angles': 9, 'n_voxels': 20000, 'n_steps': 10},
+    'medium': {'n_angles': 25, 'n_voxels': 50000, 'n_steps': 10},
+    'large': {'n_angles': 41, 'n_voxels': 100000, 'n_steps': 10},
+}
+
+#share of the ROI voxels per ROI, roughly as in the clinical data
+ROI_SHARES = {
+    'Cornea': 0.15, 'CiliaryBody': 0.02, 'Iris': 0.14, 'Lens': 0.03, 'Macula': 0.08,
+    'OpticalDisc': 0.16, 'Retina': 0.18, 'OpticalNerve': 0.06, 'Tumor': 0.18,
+}
+
+#filters of the filter and update benchmarks, {roi: {'dose': max dose, 'volume': volume}}
+FILTERS = [
+    {'Macula': {'dose': 30., 'volume': 2}},
+    {'Macula': {'dose': 30., 'volume': 2}, 'OpticalDisc': {'dose': 40., 'volume': 20}},
+    {'Lens': {'dose': 20., 'volume': 5}},
+]
+
+
+def gaze_angles(n_angles):
+    """
+    Straight gaze followed by rings of 8 azimuthal angles, 25° polar spacing.
+    """
+    if (n_angles - 1) % 8 != 0:
+        raise ValueError(f"n_angles must be 1 + a multiple of 8, not {n_angles}.")
+    angles = [(0, 0)]
+    for ring in range((n_angles - 1) // 8):
+        angles += [(25 * (ring + 1), float(azimuthal)) for azimuthal in range(0, 360, 45)]
+    return angles
+
+def write_synthetic_patient(data_dir, patient_id, n_angles, n_voxels, seed=0):
+    """
+    Write a patient h5 file in the layout `Patient` reads. ROI voxels are scattered over a dose
+    grid twice their size, the dose of a voxel falls off with its distance to the beam axis.
+    Returns:
+    str: Path of the h5 file.
+    """
+    rng = np.random.default_rng(seed)
+    n_grid = 2 * n_voxels
+    path = h5_file_path(patient_id, data_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    #voxel positions in the unit ball
+    positions = rng.normal(size=(n_grid, 3))
+    positions *= (rng.random(n_grid) ** (1/3) / np.linalg.norm(positions, axis=1))[:, None]
+
+    roi_voxels = rng.permutation(n_grid)[:n_voxels]
+    roi_sizes = np.round(np.array(list(ROI_SHARES.values())) * n_voxels).astype(int)
+    roi_bounds = np.concatenate([[0], np.cumsum(roi_sizes)])
+
+    with h5py.File(path, 'w') as h5_file:
+        h5_file.attrs['patient_id'] = patient_id
+        h5_file.attrs['roi_names'] = list(ROI_SHARES)
+        h5_file.attrs['voxel_volume'] = 0.001
+        for i, roi in enumerate(ROI_SHARES):
+            mask = np.sort(roi_voxels[roi_bounds[i]:roi_bounds[i+1]])
+            relative_volumes = np.where(rng.random(len(mask)) < 0.1, rng.uniform(0.2, 1, len(mask)), 1.)
+            h5_file[f'{roi}_mask'] = mask
+            h5_file[f'{roi}_relative_volumes'] = relative_volumes
+
+        for polar, azimuthal in gaze_angles(n_angles):
+            p, a = np.deg2rad(polar), np.deg2rad(azimuthal)
+            direction = np.array([np.sin(p) * np.cos(a), np.sin(p) * np.sin(a), np.cos(p)])
+            distance = np.linalg.norm(positions - np.outer(positions @ direction, direction), axis=1)
+            h5_file[str((polar, azimuthal))] = 60 * np.exp(-3 * distance) * rng.uniform(0.95, 1.05, n_grid)
+    return path
+
+def measure(func, repeat, n_items, unit, setup=None):
+    """
+    Best and median wall time of `repeat` calls of `func` and the peak memory of one more traced
+    call. `setup` runs untimed before every call.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': min(times),
+        'median_seconds': statistics.median(times),
+        'peak_mb': peak / 2**20,
+        'items': n_items,
+        'unit': unit,
+        'per_second': n_items / min(times),
+    }
+
+def run_scale(scale, n_angles, n_voxels, n_steps, repeat, work_dir):
+    """
+    All benchmarks on one synthetic patient.
+    Returns:
+    dict: Results by benchmark name, plus the size of the patient.
+    """
+    patient_id = f'SYN-{scale}'
+    cache_dir = os.path.join(work_dir, 'cache')
+    write_synthetic_patient(work_dir, patient_id, n_angles=n_angles, n_voxels=n_voxels)
+    patient = Patient(patient_id=patient_id, h5_file_path=h5_file_path(patient_id, work_dir), dvh_edges=DVH_EDGES)
+    store = patient.dose_store
+    results = {}
+
+    #dvhs of every roi and gaze angle, one at a time and batched
+    doses = store.doses
+    roi_masks, roi_relative_values = store.roi_masks, store.roi_relative_values
+    def single_dvhs():
+        for dose in doses:
+            for roi in patient.roi_names:
+                cumulative_dvh(dose[roi_masks[roi]], roi_relative_values[roi], patient.voxel_vol, bins=patient.num_dvh_bins)
+    n_dvhs = len(doses) * len(patient.roi_names)
+    results['cumulative_dvh'] = measure(single_dvhs, repeat, n_dvhs, 'dvhs')
+    results['dvh_engine'] = measure(lambda: patient.dvh_engine.compute(doses), repeat, n_dvhs, 'dvhs')
+
+    #plans from dose rows, DVHs batched
+    rows = doses[np.arange(256) % len(doses)]
+    keys = [store.angle_keys[i % len(doses)] for i in range(256)]
+    results['treatment_plans'] = measure(lambda: build_treatment_plans(patient, rows, keys), repeat, len(rows), 'plans')
+
+    #all single and two beam plans
+    plans = find_all_gaze_combos(patient, n_steps=n_steps)
+    results['find_all_gaze_combos'] = measure(lambda: find_all_gaze_combos(patient, n_steps=n_steps), repeat, len(plans), 'plans')
+    del plans
+
+    #everything below works on the app's view of the patient
+    precompute_plan_set(patient, n_steps=n_steps, cache_dir=cache_dir, verbose=False)
+    data = PatientData(patient_id, data_dir=work_dir, cache_dir=cache_dir, n_steps=n_steps)
+    metrics = [Metric(roi, *ESPENSEN_METRICS[roi][:2]) if ESPENSEN_METRICS[roi][0] else None for roi in ROI_NAMES]
+
+    #filters through the filter index, first with the Dx columns still to compute
+    def filters():
+        for filter_dict in FILTERS:
+            data.filter_index.mask(filter_dict, eps=EPS)
+    def drop_dx_columns():
+        for filter_dict in FILTERS:
+            for roi, f in filter_dict.items():
+                data.plan_set.memo.entries.pop((roi, 'D', float(f['volume'])), None)
+    results['filter_index_build'] = measure(filters, repeat, len(FILTERS) * data.n_plans, 'plans', setup=drop_dx_columns)
+    results['filter_index'] = measure(filters, repeat, len(FILTERS) * data.n_plans, 'plans')
+
+    mask = np.ones(data.n_plans, dtype=bool)
+    highlight_ids = {data.single_beam_ids[key]: color for key, color in zip(patient.gaze_angle_keys, COLORS)}
+    def figures():
+        for i, roi in enumerate(ROI_NAMES):
+            make_dvh_figure(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metrics[i]).to_json()
+    results['make_dvh_figure'] = measure(figures, repeat, len(ROI_NAMES), 'figures')
+
+    #the plot callback after a new filter: filter mask and a serialized patch of every figure
+    def reset_filters():
+        data.filter_masks = FilterMasks(data.filter_index, eps=EPS)
+    def update():
+        for filter_dict in FILTERS:
+            mask = filter_mask(data, filter_dict)
+            to_json_plotly([
+                patch_plans(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metrics[i], filter_dict=filter_dict)
+                for i, roi in enumerate(ROI_NAMES)
+            ])
+    results['update'] = measure(update, repeat, len(FILTERS) * len(ROI_NAMES), 'figures', setup=reset_filters)
+
+    return {
+        'patient': {'n_angles': n_angles, 'n_voxels': store.n_voxels, 'n_steps': n_steps, 'n_plans': data.n_plans},
+        'benchmarks': results,
+    }
+
+def print_results(scale, results, baseline=None):
+    print(f"\n{scale}: {', '.join(f'{k} {v}' for k, v in results['patient'].items())}")
+    for name, result in results['benchmarks'].items():
+        line = f"{name:>22}: {result['seconds']:9.4f} s {result['peak_mb']:9.1f} MB {result['per_second']:12.1f} {result['unit']}/s"
+        previous = (baseline or {}).get(scale, {}).get('benchmarks', {}).get(name)
+        if previous is not None:
+            line += f"  {previous['seconds'] / result['seconds']:6.2f}x vs. baseline"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchmark', description="Benchmark the hot paths on synthetic patients.")
+    parser.add_argument("--scales", nargs='+', default=['small', 'medium'], choices=list(SCALES), help="Synthetic patient sizes. Default is small medium.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark. Default is 3.")
+    parser.add_argument("--output", type=str, default='benchmark.json', help="JSON file the results are written to. Default is benchmark.json.")
+    parser.add_argument("--baseline", type=str, default=None, help="JSON file of an earlier run to compare with.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['scales']
+
+    output = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__},
+        'repeat': args.repeat,
+        'scales': {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in args.scales:
+            output['scales'][scale] = run_scale(scale, repeat=args.repeat, work_dir=work_dir, **SCALES[scale])
+            print_results(scale, output['scales'][scale], baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=1)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
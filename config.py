@@ -3,20 +3,35 @@
 import matplotlib.pyplot as plt
 
 from GazeOptimizer.patient_functions.patient import *
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+from GazeOptimizer.patient_functions.plan_cache import load_plan_cache
+from GazeOptimizer.patient_functions.filter_index import FilterIndex, FilterMasks
+from GazeOptimizer.patient_functions.angle_index import angle_plan_ids
+from GazeOptimizer.patient_functions.memo import MemoCache
+from GazeOptimizer.patient_functions.registry import PatientRegistry
 
 from itertools import cycle
-import h5py
-import pickle
+import os
 
-PATIENT_ID = 'P23336'
-H5_FILE_PATH = f'data/{PATIENT_ID}/{PATIENT_ID}_9_angles.h5'
+PATIENT_ID = 'P23336' #patient shown on start
+DATA_DIR = "data" #one folder per patient
 
-PICKLE_PATH = f"data/pickles/{PATIENT_ID}_9_combo.dat"
+CACHE_DIR = "data/cache"
+REGISTRY_MAX_BYTES = 2 * 2**30 #memory budget of all loaded patients
+START_FIGURE_MEMO_SIZE = 4 #unfiltered figure sets kept per loaded patient, shown when switching to it
+JOBS_DIR = "data/jobs" #status files of precompute jobs
+N_STEPS = 10 #beam weight steps of two beam plans
 
 ROI_NAMES = ['Cornea', 'CiliaryBody', 'Iris', 'Lens', 'Macula', 'OpticalDisc', 'Retina', 'OpticalNerve']
 N_PLOTS = len(ROI_NAMES)
 
-N_POINTS = 100 #points on dvh plots
+N_POINTS = 100 #maximum points per dvh on plots, decimated from the dvh bins
+MIN_POINTS = 20 #points per dvh of filtered out plans, minimum for the remaining ones
+POINT_LEVELS = (N_POINTS, 50, MIN_POINTS) #points per dvh snap to these, so decimated dvhs are reused across masks
+FIGURE_POINTS = 20000 #point budget of all dvhs of a figure, remaining plans are subsampled beyond it
+GREY_POINTS = 5000 #part of the budget for filtered out plans, subsampled beyond it
+DECIMATED_MEMO_SIZE = N_PLOTS * len(POINT_LEVELS) #decimated dvhs of every roi at every level, never evicted
+DVH_EDGES = 'roi' #all dvhs of a roi share one dose axis
 
 ESPENSEN_METRICS = {
     "Cornea": ("D", 20, None),
@@ -35,6 +50,10 @@ FIGSIZE_X = 950
 FIGSIZE_Y = 420
 CMAP = plt.cm.viridis
 EPS = 0.5
+N_COLOR_BUCKETS = 32 #line traces per beam count on dvh plots, plans are grouped by colorscale bin
+BEAM_COLUMNS = ['value', 'polar_1', 'azimuthal_1', 'weight_1', 'polar_2', 'azimuthal_2', 'weight_2'] #hover data of a plan, see make_beam_table
+BEAM_COLUMN = {name: i for i, name in enumerate(BEAM_COLUMNS)}
+SINGLE_BEAM_COLUMNS = BEAM_COLUMN['weight_1'] #value and angle of single beam plans come first
 
 TWO_BEAMS=True
 
@@ -49,68 +68,94 @@ COLORS = [c[0] for c in COLORS]
 HIGHLIGHT_COLORS = cycle(COLORS)
 
 
-PATIENT = Patient(patient_id=PATIENT_ID, h5_file_path=H5_FILE_PATH)
-with h5py.File(PATIENT.h5_file_path, "r") as h5_file:
-    PLANS_1_BEAM = [TreatmentPlan(PATIENT, angle_key=angle_key, dose=h5_file[angle_key][:]) for angle_key in PATIENT.gaze_angle_keys]
-
-def load_data():
-    try:
-        with open(PICKLE_PATH) as f:
-            plans_2_beam = pickle.load(f)
+def h5_file_path(patient_id, data_dir=DATA_DIR):
+    return f'{data_dir}/{patient_id}/{patient_id}_9_angles.h5'
+
+def available_patients():
+    """
+    Patients with an h5 file in DATA_DIR.
+    """
+    return sorted(patient_id for patient_id in os.listdir(DATA_DIR) if os.path.exists(h5_file_path(patient_id)))
+
+def cached_patients():
+    """
+    Patients with an h5 file and a plan cache, the cache is only validated when it is loaded.
+    """
+    return [
+        patient_id for patient_id in available_patients()
+        if os.path.isdir(os.path.join(CACHE_DIR, patient_id))
+        and any(os.path.exists(os.path.join(CACHE_DIR, patient_id, key, 'manifest.json')) for key in os.listdir(os.path.join(CACHE_DIR, patient_id)))
+    ]
+
+def load_data(patient, cache_dir=CACHE_DIR, n_steps=N_STEPS):
+    plan_set = load_plan_cache(patient=patient, n_steps=n_steps, cache_dir=cache_dir)
+    if plan_set is not None:
         print("loaded")
-    except:
-        plans_2_beam = []
-    return plans_2_beam
-
-def save_data(data):
-    with open(PICKLE_PATH, "wb") as f:
-        pickle.dump(data, f)
-        print('saved')
-
-
-
-
-def find_all_gaze_combos(n_steps=3):
-    print("Calculating Combos")
-    plans = []
-    with h5py.File(PATIENT.h5_file_path, "r") as h5_file:
-        for i, gaze_angle_key_1 in enumerate(PATIENT.gaze_angle_keys):
-
-            #Load dose 1
-            dose_1 = h5_file[gaze_angle_key_1][:]
-
-            #Add single beam dose
-            plans.append(TreatmentPlan(
-                patient=PATIENT, 
-                angle_key=gaze_angle_key_1, 
-                dose=dose_1)
-            )
-            
-            
-            for gaze_angle_key_2 in PATIENT.gaze_angle_keys[i+1:]:
-                dose_2 = h5_file[gaze_angle_key_2][:]
-
-                #add all two beam plans
-                for w in np.linspace(0, 1, n_steps, endpoint=False)[1:]:
-                    combined_dose = w*dose_1 + (1-w)*dose_2
-                    p = TreatmentPlan(
-                        patient=PATIENT,
-                        angle_key=gaze_angle_key_1,
-                        angle_key_2=gaze_angle_key_2,
-                        dose=combined_dose,
-                        beam_weight=w
-                    )
-                    plans.append(p)
-    print("Finished")
-    print(len(plans))
-    return plans
-
-if TWO_BEAMS: 
-    plans_2_beam = load_data()
-    if plans_2_beam == []:
-        plans_2_beam = find_all_gaze_combos(n_steps=10)
-        save_data(plans_2_beam)
-    ALL_PLANS = plans_2_beam
-
-
-else: ALL_PLANS = PLANS_1_BEAM
+    return plan_set
+
+def make_beam_table(patient, angle_idx, beam_weights):
+    """
+    Hover data of every plan, one row per plan with the columns of BEAM_COLUMNS. The metric
+    value is set per figure, beam 2 columns stay nan for single beam plans.
+    angle_idx, beam_weights: Gaze angles and weights of the first two beams, see `PlanSet.beams`.
+    """
+    table = np.full((len(angle_idx), len(BEAM_COLUMNS)), np.nan, dtype=np.float32)
+    for k in range(2):
+        has_beam = angle_idx[:, k] >= 0
+        table[has_beam, BEAM_COLUMN[f'polar_{k+1}']] = patient.polar[angle_idx[has_beam, k]]
+        table[has_beam, BEAM_COLUMN[f'azimuthal_{k+1}']] = patient.azimuthal[angle_idx[has_beam, k]]
+        table[:, BEAM_COLUMN[f'weight_{k+1}']] = np.round(beam_weights[:, k], 1)
+    return table
+
+
+class PatientData:
+    """
+    Plans of a patient and everything the app derives from them.
+    Plans are identified by their position in the plan set, sets of plans are boolean masks
+    over it. Gaze angles are identified by their position in `patient.gaze_angle_keys`.
+    The data and cache directories default to the app's, e.g. benchmarks open synthetic patients.
+    """
+    def __init__(self, patient_id, data_dir=DATA_DIR, cache_dir=CACHE_DIR, n_steps=N_STEPS):
+        self.patient = Patient(patient_id=patient_id, h5_file_path=h5_file_path(patient_id, data_dir), dvh_edges=DVH_EDGES)
+
+        if TWO_BEAMS: 
+            #plans are built offline, the app only opens an existing cache
+            self.plan_set = load_data(self.patient, cache_dir=cache_dir, n_steps=n_steps)
+            if self.plan_set is None:
+                raise FileNotFoundError(
+                    f'No plan cache for patient {patient_id} with {n_steps} steps in {cache_dir}. '
+                    f'Build it with: python gazeopt.py precompute --patient {patient_id} --n-steps {n_steps}'
+                )
+        else: 
+            self.plan_set = PlanSet(list(self.patient.gaze_angle_dvhs.load_all().values()))
+        self.plans = self.plan_set.plans
+
+        #plan metadata comes from the plan set's arrays, plans are only built when clicked or highlighted
+        self.n_plans = len(self.plan_set)
+        angle_idx, beam_weights = self.plan_set.beams()
+        self.single_beam = angle_idx[:, 1] < 0
+        self.single_beam_ids = {self.patient.gaze_angle_keys[angle_idx[plan_id, 0]]: plan_id for plan_id in np.flatnonzero(self.single_beam)}
+        self.plan_angles = angle_idx[:, 0] #gaze angle of the first beam
+        self.angle_single_beam_id, self.angle_plan_ids = angle_plan_ids(angle_idx, len(self.patient.gaze_angle_keys))
+
+        self.filter_index = FilterIndex(self.plan_set)
+        self.filter_masks = FilterMasks(self.filter_index, eps=EPS) #cached single filter masks, shared by all sessions
+        self.beam_table = make_beam_table(self.patient, angle_idx, beam_weights)
+        self.decimated_dvhs = MemoCache(maxsize=DECIMATED_MEMO_SIZE) #decimated dvhs of the plans drawn so far, by roi and points per dvh
+        self.start_figures = MemoCache(maxsize=START_FIGURE_MEMO_SIZE) #unfiltered figures, by metrics and pareto toggle
+
+    def __str__(self):
+        return f'PatientData of patient {self.patient.patient_id}, {self.n_plans} plans, {self.nbytes() / 2**20:.1f} MB'
+
+    def nbytes(self):
+        """
+        Memory of the patient's arrays, memory-mapped DVHs counted as loaded.
+        """
+        arrays = [self.beam_table, *self.plan_set.volumes.values(), *self.patient.roi_masks.values()]
+        #decimated dvhs only count the plans decimated so far
+        decimated = sum((idx.itemsize + volumes.itemsize) * idx.shape[1] * done.sum() + done.nbytes for idx, volumes, done in self.decimated_dvhs.entries.values())
+        return sum(array.nbytes for array in arrays) + decimated + self.plan_set.memo_nbytes() + self.patient.dose_store.nbytes()
+
+
+#loaded patients, switching between them only looks them up
+REGISTRY = PatientRegistry(load=PatientData, max_bytes=REGISTRY_MAX_BYTES)
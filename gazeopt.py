@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from GazeOptimizer.patient_functions.patient import Patient
+from GazeOptimizer.patient_functions.precompute import precompute_plan_set
+
+
+def precompute(args):
+    h5_file_path = args.h5 if args.h5 is not None else f'{args.data_dir}/{args.patient}/{args.patient}_9_angles.h5'
+    patient = Patient(
+        patient_id=args.patient,
+        h5_file_path=h5_file_path,
+        num_dvh_bins=args.bins,
+        dvh_edges=args.dvh_edges
+    )
+    print(patient)
+    precompute_plan_set(
+        patient=patient,
+        n_steps=args.n_steps,
+        cache_dir=args.cache_dir,
+        workers=args.workers
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='gazeopt', description="Gaze angle optimization tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_precompute = subparsers.add_parser('precompute', help="Build the plan cache of a patient for the Dash app.")
+    parser_precompute.add_argument("--patient", type=str, required=True, help="Patient ID, e.g. P23336")
+    parser_precompute.add_argument("--n-steps", type=int, default=10, help="Beam weight steps of two beam plans. Default is 10.")
+    parser_precompute.add_argument("--h5", type=str, default=None, help="Patient h5 file. Default is <data-dir>/<patient>/<patient>_9_angles.h5")
+    parser_precompute.add_argument("--data-dir", type=str, default='data', help="Directory containing one folder per patient. Default is data.")
+    parser_precompute.add_argument("--cache-dir", type=str, default='data/cache', help="Plan cache directory. Default is data/cache.")
+    parser_precompute.add_argument("--bins", type=int, default=200, help="Dose bins per DVH. Default is 200.")
+    parser_precompute.add_argument("--dvh-edges", type=str, default='roi', choices=['roi', 'patient'], help="Share dose axes per ROI or per patient. Default is roi.")
+    parser_precompute.add_argument("--workers", type=int, default=1, help="Worker processes for the two beam sweep. Default is 1.")
+    parser_precompute.set_defaults(func=precompute)
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+    args.func(args)
+    print(f"Elapsed time: {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
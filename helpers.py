@@ -1,141 +1,203 @@
 from config import *
-from GazeOptimizer.patient_functions.helpers import get_angle_from_key, get_angles_from_keys
 from GazeOptimizer.patient_functions.patient import Metric
+from GazeOptimizer.patient_functions.decimation import lttb_indices
 import plotly.graph_objs as go
+from dash import Patch
 from plotly.subplots import make_subplots
-import matplotlib.cm as cm
+
+
+#trace layout of every ROI figure
+TRACE_OLD = 0                                       #grey lines of all filtered out plans
+TRACE_BUCKETS = 1                                   #N_COLOR_BUCKETS single beam, then N_COLOR_BUCKETS two beam line traces
+TRACE_SCATTER_OLD = TRACE_BUCKETS + 2*N_COLOR_BUCKETS #gaze angles of filtered out single beam plans
+TRACE_SCATTER = TRACE_SCATTER_OLD + 1               #gaze angles of remaining single beam plans
+TRACE_SCATTER_HIGHLIGHT = TRACE_SCATTER + 1         #circles around highlighted gaze angles
+TRACE_HIGHLIGHT = TRACE_SCATTER_HIGHLIGHT + 1       #per highlight color: DVHs of highlighted plans passing the filters, then of the others (dotted)
+TRACE_FILTER_MARKER = TRACE_HIGHLIGHT + 2*len(COLORS) #filter point of the ROI
 
 
 # ============================================================
 # CALLBACK HELPERS
 # ============================================================
 
-def get_new_click(last_click, this_click):
-    for last, this in zip(last_click, this_click):
-        if this is None: 
-            continue
-        elif this == last: 
-            continue
-        else: return this
+def make_colorscale(n_colors=256):
+    """
+    Plotly colorscale of the colormap CMAP with `n_colors` uniformly spaced entries.
+    """
+    rgb = (CMAP(np.linspace(0, 1, n_colors))[:, :3] * 255).astype(int)
+    return [[i / (n_colors - 1), f"rgb({r}, {g}, {b})"] for i, (r, g, b) in enumerate(rgb)]
+
+#built once, shared by all figures
+COLORSCALE = make_colorscale()
+COLORSCALE_COLORS = np.array([color for _, color in COLORSCALE])
+
+def color_indices(values, vmin, vmax):
+    """
+    Index of the COLORSCALE entry of every value, the closest one to its position between
+    vmin and vmax, the way Plotly maps values to colors.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.nan_to_num((np.asarray(values, dtype=float) - vmin) / (vmax - vmin), posinf=1., neginf=0.)
+    return np.clip(np.rint(frac * (len(COLORSCALE) - 1)).astype(int), 0, len(COLORSCALE) - 1)
 
-def make_colorscale(plans, roi, metric, n_colors=256):
+def plan_values(data, roi, metric, plan_ids=None):
     """
-    Create a Plotly colorscale based on the range of `values` using the Viridis colormap.
-    Returns a list usable as `colorscale` in Plotly.
+    Metric values of the plans `plan_ids` (plan IDs or a boolean mask, all plans if None),
+    the area under the DVH if `metric` is None.
     """
     if metric is None:
-        values = [plan.dvhs[roi].get_dvh_auc() for plan in plans]
+        return data.plan_set.auc(roi=roi, plans=plan_ids)
 
     elif metric.metric_type in ['D', 'V']:
-        values = [plan.dvhs[roi].get_metric_value(metric) for plan in plans]
+        return data.plan_set.metric(roi=roi, metric_type=metric.metric_type, metric_value=metric.metric_value, plans=plan_ids)
     
     else: print('Metric Invalid')
 
-    vmin, vmax = np.min(values), np.max(values)
-    cmap = cm.get_cmap("viridis", n_colors)
-
-    colorscale = []
-    for i in range(n_colors):
-        # normalized position (0–1) in the colorscale
-        frac = i / (n_colors - 1)
 
-        # get RGBA from matplotlib colormap
-        r, g, b, _ = cmap(frac)
+def metric_label(metric):
+    return "AUC: " if metric is None else f"{metric.metric_type}{metric.metric_value}: "
 
-        # convert to rgb string
-        color_str = f"rgb({int(r*255)}, {int(g*255)}, {int(b*255)})"
-
-        colorscale.append([frac, color_str])
-    return colorscale, values
-
-def get_line_color(value, values, colorscale):
+def dvh_points(n_plans, budget=FIGURE_POINTS):
     """
-    Return the exact color corresponding to `value`
-    based on the colorscale created from `values`.
-    Assumes `value` is one of the original values.
+    Largest of POINT_LEVELS at which the DVHs of `n_plans` plans fit a point budget, counting the
+    NaN after every DVH. The smallest level if none does, the plans are subsampled then.
     """
-    values = np.array(values, dtype=float)
-    vmin, vmax = values.min(), values.max()
-
-    # normalize value to 0–1 exactly the same way as Plotly
-    frac = (value - vmin) / (vmax - vmin)
+    for n_points in POINT_LEVELS:
+        if n_plans * (n_points + 1) <= budget:
+            return n_points
+    return POINT_LEVELS[-1]
 
-    # find the closest matching entry in the colorscale
-    # because colorscale is defined on uniform 0–1 steps
-    positions = np.array([p for p, _ in colorscale])
-    idx = np.argmin(np.abs(positions - frac))
-
-    return colorscale[idx][1]
+def subsample_plan_ids(plan_ids, n_points, budget):
+    """
+    Plans evenly subsampled so that their DVHs fit a point budget at `n_points` points each.
+    """
+    n_max = max(budget, 0) // (n_points + 1)
+    if len(plan_ids) > n_max:
+        plan_ids = plan_ids[np.linspace(0, len(plan_ids)-1, n_max).astype(int)]
+    return plan_ids
 
+def grey_plan_ids(mask):
+    """
+    Filtered out plans drawn in grey, evenly subsampled to fit GREY_POINTS at MIN_POINTS points each.
+    """
+    return subsample_plan_ids(np.flatnonzero(~mask), MIN_POINTS, GREY_POINTS)
 
-def plot_dvh(subplot, roi, plan, value, metric, line_args={"width": 2}, opacity=1.):
-    if plan.angle_key_2:
-        w = np.round(plan.beam_weight, 1)
-        metric_str = f"{w}*{plan.angle_key}° + {1-w}*{plan.angle_key_2}°<br>"
-    
+def decimated_dvhs(data, roi, n_points, plan_ids):
+    """
+    DVHs of plans of a ROI decimated to `n_points` points each, metrics use the full DVHs.
+    Plans are decimated the first time they are drawn at a point count and kept. Only the indices
+    of the kept DVH bins and the kept volumes (float32) are stored, doses are looked up in the
+    ROI's dose axis when plotted.
+    Returns:
+    Tuple[np.ndarray]: Kept bin indices and volumes of the plans (plans x n_points).
+    """
+    volumes = data.plan_set.volumes[roi]
+    n_points = min(n_points, volumes.shape[1])
+    def allocate():
+        shape = (len(volumes), n_points)
+        return np.empty(shape, dtype=np.min_scalar_type(volumes.shape[1])), np.empty(shape, dtype=np.float32), np.zeros(len(volumes), dtype=bool)
+    idx, kept, done = data.decimated_dvhs.get_or_compute((roi, n_points), allocate)
+
+    missing = np.unique(plan_ids[~done[plan_ids]])
+    if len(missing):
+        dose = data.plan_set.dose[roi]
+        missing_idx = lttb_indices(dose if len(dose) == 1 else dose[missing], volumes[missing], n_points)
+        idx[missing] = missing_idx
+        kept[missing] = np.take_along_axis(volumes[missing], missing_idx, axis=1)
+        done[missing] = True
+    return idx[plan_ids], kept[plan_ids]
+
+def pack_lines(data, roi, plan_ids, n_points=N_POINTS):
+    """
+    DVHs of many plans as one line, separated by NaN.
+    Returns:
+    Tuple[np.ndarray]: Doses and volumes (float32), at most n_points+1 points per plan.
+    """
+    idx, volumes = decimated_dvhs(data, roi, n_points, plan_ids)
+    dose = data.plan_set.dose[roi]
+    #one dose axis shared by all plans, or one per plan
+    dose = dose[0][idx] if len(dose) == 1 else np.take_along_axis(dose[plan_ids], idx.astype(np.intp), axis=1)
+    n_plans, n = volumes.shape
+    x = np.full((n_plans, n+1), np.nan, dtype=np.float32)
+    y = np.full((n_plans, n+1), np.nan, dtype=np.float32)
+    x[:, :-1], y[:, :-1] = dose, volumes
+    return x.ravel(), y.ravel()
+
+def line_trace(data, roi, plan_ids, color, values=None, metric=None, single_beam=True, opacity=0.7, width=None, dash=None, gl=True, n_points=N_POINTS):
+    """
+    One Scattergl trace (Scatter if not `gl`) drawing the DVHs of many plans. If `values` (metric value 
+    of every plan) is given, every point carries its plan's hover data, otherwise the trace has no hover.
+    """
+    trace_type = go.Scattergl if gl else go.Scatter
+    trace = dict(mode="lines", line=dict(color=color, width=width, dash=dash), opacity=opacity)
+    #empty traces keep their place in the figure without decimating anything
+    if len(plan_ids) == 0:
+        return trace_type(**trace, x=[], y=[], hoverinfo="skip")
+
+    x, y = pack_lines(data, roi, plan_ids, n_points=n_points)
+    trace.update(x=x, y=y)
+    if values is None:
+        return trace_type(**trace, hoverinfo="skip")
+
+    #single beam plans only need the first angle
+    columns = SINGLE_BEAM_COLUMNS if single_beam else len(BEAM_COLUMNS)
+    customdata = data.beam_table[plan_ids, :columns].copy()
+    customdata[:, BEAM_COLUMN['value']] = values[plan_ids]
+    customdata = np.repeat(customdata, len(x) // max(len(plan_ids), 1), axis=0)
+    column = lambda name: f"%{{customdata[{BEAM_COLUMN[name]}]}}"
+    if single_beam:
+        angles = f"({column('polar_1')}, {column('azimuthal_1')})°<br>"
     else:
-        metric_str = f"{plan.angle_key}°<br>"
-    metric_str += "<br>"
-    metric_str += "AUC: " if metric is None else f"{metric.metric_type}{metric.metric_value}: "
-    metric_str += str(np.round(value, 1))
-    hoverinfo = "skip" if opacity < 0.5 else "all"
-
-    dvh = plan.dvhs[roi]
-    subplot.add_trace(
-        go.Scatter(
-            x=dvh.dose,
-            y=dvh.volume,
-            mode="lines",
-            line=line_args,
-            opacity=opacity,
-            hoverinfo=hoverinfo,
-            hovertemplate=
-                'D: %{x:.1f}<br>' +
-                'V: %{y:.1f}<br>' +
-                metric_str,
-            
-        ),
-        row=1, col=1
+        angles = (
+            f"{column('weight_1')}*({column('polar_1')}, {column('azimuthal_1')})° + "
+            f"{column('weight_2')}*({column('polar_2')}, {column('azimuthal_2')})°<br>"
+        )
+    return trace_type(
+        **trace,
+        customdata=customdata,
+        hovertemplate=
+            'D: %{x:.1f}<br>' +
+            'V: %{y:.1f}<br>' +
+            angles + "<br>" + metric_label(metric) + f"%{{customdata[{BEAM_COLUMN['value']}]:.1f}}<extra></extra>"
     )
 
-def plot_scatter(subplot, plans, colors, metric=None, colorscale=None, opacity=1., showscale=False):
-    angle_keys = [plan.angle_key for plan in plans if not plan.angle_key_2]
-    polars, thetas = get_angles_from_keys(angle_keys=angle_keys, azimuthal_as_radian=False)
-    title = 'Area under DVH' if metric is None else metric.name
-    subplot.add_trace(
-        go.Scatterpolar(
-            theta=thetas,
-            r=polars,
-            mode="markers",
-            marker=dict(
-                size=15,
-                color=colors,
-                colorscale=colorscale,
-                colorbar=dict(title=title),
-                showscale=showscale,
-                opacity=opacity
-            )
-        ),
-        row=1, col=2
-    )
+def color_buckets(values, vmin, vmax):
+    """
+    Colorscale bin of every value, N_COLOR_BUCKETS bins between vmin and vmax.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.nan_to_num((values - vmin) / (vmax - vmin), posinf=1., neginf=0.)
+    return np.clip((frac * N_COLOR_BUCKETS).astype(int), 0, N_COLOR_BUCKETS-1)
+
+def plan_angles(data, plan_ids):
+    """
+    Polar and azimuthal angle (degrees) of the first beam of plans.
+    """
+    angle_idx = data.plan_angles[np.asarray(plan_ids, dtype=int)]
+    return data.patient.polar[angle_idx], data.patient.azimuthal[angle_idx]
 
-def highlight_scatter(subplot, highlight_plans):
-    angle_keys = [plan.angle_key for plan in highlight_plans]
-    polars, azimuthals = get_angles_from_keys(angle_keys=angle_keys, azimuthal_as_radian=False)
-    colors = [highlight_plans[plan] for plan in highlight_plans]
-    subplot.add_trace(
-        go.Scatterpolar(
-            r=polars,
-            theta=azimuthals,
-            mode='markers',
-            marker=dict(
-                size=18,                 # bigger circle
-                symbol="circle-open",    # open circle outline!
-                line=dict(width=3),
-                color=colors
-            ),
+def scatter_trace(data, plan_ids, colors, metric=None, colorscale=None, opacity=1., showscale=False, color_range=(None, None)):
+    """
+    Gaze angles of single beam plans, `plan_ids` and `colors` must only contain single beam plans.
+    color_range: Values mapped to the ends of the colorscale, the range of `colors` if not given.
+    """
+    polars, thetas = plan_angles(data, plan_ids)
+    title = 'Area under DVH' if metric is None else metric.name
+    return go.Scatterpolar(
+        theta=thetas,
+        r=polars,
+        mode="markers",
+        marker=dict(
+            size=15,
+            color=colors,
+            colorscale=colorscale,
+            cmin=color_range[0],
+            cmax=color_range[1],
+            colorbar=dict(title=title),
+            showscale=showscale,
+            opacity=opacity
         ),
-        row=1, col=2
+        subplot="polar"
     )
 
 def plot_metric(subplot, metric):
@@ -156,9 +218,96 @@ def plot_metric(subplot, metric):
             row=1, col=1
         ),
 
-    
+def plan_traces(data, roi, mask, metric=None):
+    """
+    Traces TRACE_OLD up to TRACE_SCATTER of a ROI figure.
+    mask: Boolean mask of the plans passing the filters, all other plans are grey.
+    """
+    all_values = plan_values(data, roi=roi, metric=metric)
+    values = all_values[mask]
+
+    #Plot old plans in grey, their points count against the point budget of the figure
+    grey_ids = grey_plan_ids(mask)
+    traces = [line_trace(data, roi=roi, plan_ids=grey_ids, color="grey", opacity=0.1, n_points=MIN_POINTS)]
+
+    #plot remaining plans according to metric, one trace per colorscale bin, subsampled beyond the budget
+    budget = FIGURE_POINTS - len(grey_ids) * (MIN_POINTS + 1)
+    n_points = dvh_points(mask.sum(), budget=budget)
+    drawn = np.zeros_like(mask)
+    drawn[subsample_plan_ids(np.flatnonzero(mask), n_points, budget)] = True
+    vmin, vmax = (values.min(), values.max()) if mask.any() else (0, 0)
+    buckets = color_buckets(all_values, vmin, vmax)
+    bucket_colors = COLORSCALE_COLORS[color_indices(vmin + (np.arange(N_COLOR_BUCKETS) + 0.5) / N_COLOR_BUCKETS * (vmax - vmin), vmin, vmax)]
+    for single_beam in [True, False]:
+        active = drawn & (data.single_beam == single_beam)
+        for bucket, color in enumerate(bucket_colors):
+            traces.append(line_trace(
+                data,
+                roi=roi,
+                plan_ids=np.flatnonzero(active & (buckets == bucket)),
+                color=color,
+                values=all_values,
+                metric=metric,
+                single_beam=single_beam,
+                n_points=n_points
+            ))
+
+    #Plot gaze angles
+    old_ids = np.flatnonzero(~mask & data.single_beam)
+    plan_ids = np.flatnonzero(mask & data.single_beam)
+    traces.append(scatter_trace(data, plan_ids=old_ids, colors=["grey"]*len(old_ids), opacity=0.3))
+    traces.append(scatter_trace(data, plan_ids=plan_ids, metric=metric, colorscale=COLORSCALE, colors=all_values[plan_ids], showscale=bool(mask.any()), color_range=(vmin, vmax)))
+    return traces
 
-def make_dvh_figure(roi, plans, highlight_plans, metric=None, all_plans=ALL_PLANS):
+def highlight_traces(data, roi, mask, highlight_ids, metric=None):
+    """
+    Traces TRACE_SCATTER_HIGHLIGHT up to TRACE_FILTER_MARKER of a ROI figure: circles around the
+    highlighted gaze angles and their DVHs, solid if they pass `mask`, dotted otherwise.
+    highlight_ids: Highlight color of plan IDs, {plan_id: color}.
+    """
+    polars, azimuthals = plan_angles(data, list(highlight_ids))
+    traces = [go.Scatterpolar(
+        r=polars,
+        theta=azimuthals,
+        mode='markers',
+        marker=dict(
+            size=18,                 # bigger circle
+            symbol="circle-open",    # open circle outline!
+            line=dict(width=3),
+            color=list(highlight_ids.values())
+        ),
+        subplot="polar"
+    )]
+
+    all_values = plan_values(data, roi=roi, metric=metric)
+    plan_ids = np.array(list(highlight_ids), dtype=int)
+    colors = np.array([COLORS.index(color) for color in highlight_ids.values()], dtype=int)
+    for k, color in enumerate(COLORS):
+        for dash in [None, 'dot']:
+            ids = plan_ids[(colors == k) & (mask[plan_ids] == (dash is None))]
+            traces.append(line_trace(data, roi=roi, plan_ids=ids, color=color, values=all_values, metric=metric, opacity=1., width=3, dash=dash, gl=False, n_points=POINT_LEVELS[0]))
+    return traces
+
+def filter_marker_trace(filter_dict, roi):
+    """
+    Trace TRACE_FILTER_MARKER of a ROI figure, the filter point of the ROI if it has one.
+    """
+    point = filter_dict.get(roi)
+    return go.Scatter(
+        x=[point['dose']] if point else [],
+        y=[point['volume']] if point else [],
+        mode="markers",
+        marker=dict(color="red", size=15),
+        name="Selected Point"
+    )
+
+def make_dvh_figure(data, roi, mask, highlight_ids, metric=None, filter_dict={}):
+    """
+    DVHs and gaze angles of all plans of a ROI, traces in the order of the TRACE_* constants.
+    data: PatientData of the shown patient.
+    mask: Boolean mask of the plans passing the filters, all other plans are grey.
+    highlight_ids: Highlight color of plan IDs, {plan_id: color}.
+    """
     fig = make_subplots(
         rows=1, cols=2,
         specs=[[{"type": "xy"}, {"type": "polar"}]],
@@ -166,46 +315,16 @@ def make_dvh_figure(roi, plans, highlight_plans, metric=None, all_plans=ALL_PLAN
         subplot_titles=[ "DVH", "Gaze Angle"]
     )
     
-    if len(plans) > 0:
-        colorscale, values = make_colorscale(plans=plans, roi=roi, metric=metric)
-    _, all_values = make_colorscale(plans=all_plans, roi=roi, metric=metric)
-
-    old_plans = get_old_plans(plans=plans, all_plans=all_plans)
-
-    #Plot old plans in grey
-    for plan, value in zip(all_plans, all_values):
+    traces = plan_traces(data, roi=roi, mask=mask, metric=metric)
+    fig.add_traces(traces[:TRACE_SCATTER_OLD], rows=1, cols=1)
 
-        #Plot old plans in grey
-        if plan in old_plans:
-            plot_dvh(subplot=fig, roi=roi, plan=plan, value=value, metric=metric, line_args={"color": "grey"}, opacity=0.1)
-
-
-        #plot remaining plans according to metric
-        elif plan not in highlight_plans:
-            color = get_line_color(value, values=values, colorscale=colorscale)
-            plot_dvh(subplot=fig, roi=roi, plan=plan, value=value, metric=metric, line_args={"color": color}, opacity=0.7)
-
-
-    #plot highlighted plans
-    if len(highlight_plans) > 0:
-        _, highlight_values = make_colorscale(plans=highlight_plans, roi=roi, metric=metric)
-        for plan, value in zip(highlight_plans, values):    
-            dash = 'dot' if plan in old_plans else None
-            plot_dvh(subplot=fig, roi=roi, plan=plan, value=value, metric=metric, line_args={"width": 3, "color": highlight_plans[plan], "dash": dash})
-        
+    #metric lines are shapes, added before any polar trace
     if metric is not None:
         plot_metric(subplot=fig, metric=metric)
 
-    
-
-    #circle highlighted gaze angles
-    highlight_scatter(subplot=fig, highlight_plans=highlight_plans)
-
-    #Plot gaze angles
-    plot_scatter(subplot=fig, plans=old_plans, colors=["grey"]*len(old_plans), opacity=0.3)
-    if len(plans) > 0:
-        plot_scatter(subplot=fig, plans=plans, metric=metric, colorscale=colorscale, colors=values, showscale=True)
-    
+    fig.add_traces(traces[TRACE_SCATTER_OLD:])
+    fig.add_traces(highlight_traces(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metric))
+    fig.add_trace(filter_marker_trace(filter_dict=filter_dict, roi=roi))
 
     fig.update_layout(
         title=roi,
@@ -219,9 +338,77 @@ def make_dvh_figure(roi, plans, highlight_plans, metric=None, all_plans=ALL_PLAN
 
     return fig
 
-def get_old_plans(plans, all_plans=ALL_PLANS):
-    return [plan for plan in all_plans if plan not in plans]
+def start_figures(data, metrics, pareto=False):
+    """
+    Figures of all ROIs without filters and highlights, memoized per patient, so switching
+    back to a loaded patient does not rebuild them.
+    """
+    def build():
+        mask = np.ones(data.n_plans, dtype=bool)
+        if pareto:
+            mask = pareto_mask(data, mask=mask, metrics=metrics)
+        return [
+            make_dvh_figure(data, roi=roi, mask=mask, highlight_ids={}, metric=metrics[i]).to_dict()
+            for i, roi in enumerate(ROI_NAMES)
+        ]
+    key = (tuple(None if metric is None else metric.name for metric in metrics), pareto)
+    return data.start_figures.get_or_compute(key, build)
+
+def empty_figures(message):
+    """
+    Figures of all ROIs without plans showing a message, e.g. while no patient has a plan cache.
+    """
+    return [
+        go.Figure(layout=dict(
+            title=roi,
+            margin=dict(l=10, r=10, t=25, b=10),
+            height=FIGSIZE_Y,
+            width=FIGSIZE_X,
+            xaxis=dict(visible=False),
+            yaxis=dict(visible=False),
+            annotations=[dict(text=message, showarrow=False, xref="paper", yref="paper", x=0.5, y=0.5)]
+        )).to_dict()
+        for roi in ROI_NAMES
+    ]
 
+def patch_traces(patch, traces, start):
+    """
+    Replace the traces of a figure patch from index `start` on.
+    """
+    #serialized through a figure, which encodes arrays as base64 like full figures
+    for k, trace in enumerate(go.Figure(data=traces).to_dict()["data"]):
+        patch["data"][start + k] = trace
+    return patch
+
+def patch_plans(data, roi, mask, highlight_ids, metric=None, filter_dict={}):
+    """
+    Partial update of a ROI figure after the plan mask changed, replaces all traces. Layout and
+    metric lines are kept.
+    """
+    patch = patch_traces(Patch(), plan_traces(data, roi=roi, mask=mask, metric=metric), start=TRACE_OLD)
+    patch = patch_highlights(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metric, patch=patch)
+    return patch_traces(patch, [filter_marker_trace(filter_dict=filter_dict, roi=roi)], start=TRACE_FILTER_MARKER)
+
+def patch_highlights(data, roi, mask, highlight_ids, metric=None, patch=None):
+    """
+    Partial update of a ROI figure after the highlighted plans changed.
+    """
+    traces = highlight_traces(data, roi=roi, mask=mask, highlight_ids=highlight_ids, metric=metric)
+    return patch_traces(Patch() if patch is None else patch, traces, start=TRACE_SCATTER_HIGHLIGHT)
+
+def job_status_text(job):
+    """
+    One line status of a precompute job for the app.
+    """
+    text = f"{job['patient_id']}: {job['state']}"
+    if job['state'] == 'running':
+        text += f" ({job.get('step')}, {100*job['progress']:.0f}%"
+        text += ")" if job['eta'] is None else f", {job['eta']:.0f} s left)"
+        if job['cancel_requested']:
+            text += ", cancelling"
+    elif job['state'] == 'failed':
+        text += f": {job.get('error', '').splitlines()[0]}"
+    return text
 
 def add_filter(filter_dict, point, roi):
     x, y = point["x"], point["y"]
@@ -243,16 +430,29 @@ def update_after_filter_click(filter_dict, roi, dvh_point):
     return filter_dict
 
 
-def update_figures(plans, metrics, highlight_plans):    
-    return [
-        make_dvh_figure(roi=roi, plans=plans, metric=metrics[i], highlight_plans=highlight_plans)
-        for i, roi in enumerate(ROI_NAMES)
-    ]
+def filter_mask(data, filter_dict):
+    """
+    Boolean mask of the plans passing all filters.
+    """
+    return data.filter_masks.mask(filter_dict)
 
-def filter_plans(filter_dict, plans=ALL_PLANS):
-    for roi in filter_dict:
-        plans = [plan for plan in plans if plan.dvhs[roi].get_dose_at_volume(filter_dict[roi]['volume']) < filter_dict[roi]['dose']+EPS]
-    return plans
+def pareto_mask(data, mask, metrics):
+    """
+    Plans of a mask not dominated by another plan of the mask in the specified metrics.
+    """
+    objectives = [(metric.roi_name, metric.metric_type, metric.metric_value) for metric in metrics if metric is not None]
+    plan_ids = np.flatnonzero(mask)
+    if len(objectives) == 0 or len(plan_ids) == 0:
+        return mask
+    pareto = np.zeros(data.n_plans, dtype=bool)
+    pareto[plan_ids[data.plan_set.pareto_front(metrics=objectives, plans=plan_ids)]] = True
+    return pareto
+
+def get_highlight_ids(data, highlight_plan_keys):
+    """
+    Highlight colors by plan ID from the highlight store, {plan ID: color}.
+    """
+    return {int(key): color for key, color in highlight_plan_keys.items()}
 
 def clear_filters(filter_dict, roi):
     if roi in filter_dict:
@@ -260,36 +460,32 @@ def clear_filters(filter_dict, roi):
     return filter_dict
 
 
-def add_filter_marker(fig, filter_dict):
-
-    for f, roi in zip(fig, ROI_NAMES):
-        if roi in filter_dict:
-            point = filter_dict[roi]
-            f.add_trace(
-                go.Scatter(
-                    x=[point['dose']],
-                    y=[point['volume']],
-                    mode="markers",
-                    marker=dict(color="red", size=15),
-                    name="Selected Point"
-                ),
-            )
-    return fig
-
-def add_highlight(highlight_plan_keys, point):
+def add_highlight(data, highlight_plan_keys, point):
     
     polar, theta = point['r'], point['theta']
-    plan = find_plan_with_angles(polar, theta)
-    plan_key = plan.angle_key
+    plan_id = find_plan_with_angles(data, polar, theta)
+    if plan_id is None:
+        return
+    plan_key = str(plan_id)
     if plan_key in highlight_plan_keys:
         del highlight_plan_keys[plan_key]
     else: highlight_plan_keys[plan_key] = next(HIGHLIGHT_COLORS)
 
-def find_plan_with_angles(polar, theta):
-    for plan in ALL_PLANS:
-        plan_polar, plan_theta = get_angle_from_key(plan.angle_key, azimuthal_as_radian=False)
-        if (plan_polar, plan_theta) == (polar, theta):
-            return plan
+def find_plan_with_angles(data, polar, theta):
+    """
+    Plan ID of the gaze angle at (polar, theta): its single beam plan, or the lowest cost plan
+    with a beam at the angle if it has none. None if no plan uses the angle.
+    """
+    angle_idx = data.patient.gaze_angle_index.find(polar, theta)
+    if angle_idx is None:
+        return None
+    if data.angle_single_beam_id[angle_idx] >= 0:
+        return int(data.angle_single_beam_id[angle_idx])
+    plan_ids = data.angle_plan_ids[angle_idx]
+    if len(plan_ids) == 0:
+        return None
+    costs, _ = data.patient.cost_model.evaluate(data.plan_set)
+    return int(plan_ids[np.argmin(costs[plan_ids])])
 
 
 def construct_metrics(metric_type_vals, metric_value_vals):
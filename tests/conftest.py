@@ -0,0 +1,43 @@
+import h5py
+import numpy as np
+import pytest
+
+from GazeOptimizer.patient_functions.patient import Patient
+
+#ROIs of the default cost function and the tumor, which Patient skips
+ROI_NAMES = ['Cornea', 'CiliaryBody', 'Iris', 'Lens', 'Macula', 'OpticalDisc', 'Retina', 'OpticalNerve', 'Tumor']
+
+
+def write_patient(path, n_angles=9, n_voxels=3000, seed=0):
+    """
+    Small synthetic patient h5 file: straight gaze and a ring of 25° gaze angles, ROI voxels
+    scattered over a dose grid twice their size, the dose falls off with the distance to the beam axis.
+    """
+    rng = np.random.default_rng(seed)
+    n_grid = 2 * n_voxels
+    positions = rng.normal(size=(n_grid, 3))
+    positions *= (rng.random(n_grid) ** (1/3) / np.linalg.norm(positions, axis=1))[:, None]
+    roi_voxels = np.array_split(rng.permutation(n_grid)[:n_voxels], len(ROI_NAMES))
+
+    with h5py.File(path, 'w') as h5_file:
+        h5_file.attrs['roi_names'] = ROI_NAMES
+        h5_file.attrs['voxel_volume'] = 0.001
+        for roi, voxels in zip(ROI_NAMES, roi_voxels):
+            h5_file[f'{roi}_mask'] = np.sort(voxels)
+            h5_file[f'{roi}_relative_volumes'] = np.where(rng.random(len(voxels)) < 0.1, rng.uniform(0.2, 1, len(voxels)), 1.)
+
+        angles = [(0, 0)] + [(25, float(azimuthal)) for azimuthal in np.linspace(0, 360, n_angles-1, endpoint=False)]
+        for polar, azimuthal in angles:
+            p, a = np.deg2rad(polar), np.deg2rad(azimuthal)
+            direction = np.array([np.sin(p) * np.cos(a), np.sin(p) * np.sin(a), np.cos(p)])
+            distance = np.linalg.norm(positions - np.outer(positions @ direction, direction), axis=1)
+            h5_file[str((polar, azimuthal))] = 60 * np.exp(-3 * distance) * rng.uniform(0.95, 1.05, n_grid)
+    return path
+
+@pytest.fixture(scope='session')
+def patient_file(tmp_path_factory):
+    return str(write_patient(tmp_path_factory.mktemp('data') / 'SYN_9_angles.h5'))
+
+@pytest.fixture
+def patient(patient_file):
+    return Patient(patient_id='SYN', h5_file_path=patient_file, dvh_edges='roi')
@@ -0,0 +1,46 @@
+from itertools import combinations
+
+import numpy as np
+
+from GazeOptimizer.patient_functions.beam_search import BeamSearch
+from GazeOptimizer.patient_functions.combination import simplex_weights
+from GazeOptimizer.patient_functions.patient import build_beam_plans
+from GazeOptimizer.patient_functions.plan_set import PlanSet
+
+
+def brute_force(patient, max_beams, n_steps):
+    """
+    Lowest cost of all plans with up to max_beams beams and the number of plans.
+    """
+    n_angles = len(patient.gaze_angle_keys)
+    best, n_plans = np.inf, 0
+    for k in range(1, max_beams+1):
+        weights = simplex_weights(k, n_steps)
+        for angle_idx in combinations(range(n_angles), k):
+            plans = build_beam_plans(patient, idx=np.broadcast_to(angle_idx, weights.shape), weights=weights)
+            costs, _ = patient.cost_model.evaluate(PlanSet(plans))
+            best, n_plans = min(best, costs.min()), n_plans + len(plans)
+    return best, n_plans
+
+def test_beam_search_prunes_to_brute_force_optimum(patient):
+    best, n_plans = brute_force(patient, max_beams=3, n_steps=10)
+    search = BeamSearch(patient, max_beams=3, n_steps=10, max_evals=10**6)
+    plan, cost, n_evals = search.run()
+    assert np.isclose(cost, best, rtol=0, atol=1e-9)
+    assert plan.n_beams <= 3
+    assert search.n_pruned > 0
+    assert n_evals < n_plans
+
+def test_beam_search_without_cells_evaluates_every_plan(patient):
+    best, n_plans = brute_force(patient, max_beams=2, n_steps=10)
+    search = BeamSearch(patient, max_beams=2, n_steps=10, max_evals=10**6, cell_size=1)
+    _, cost, n_evals = search.run()
+    assert np.isclose(cost, best, rtol=0, atol=1e-9)
+    assert search.n_pruned == 0
+    assert n_evals == n_plans
+
+def test_beam_search_budget(patient):
+    search = BeamSearch(patient, max_beams=3, n_steps=10, max_evals=100)
+    search.run()
+    assert search.exhausted
+    assert search.n_evals == 100
@@ -0,0 +1,25 @@
+import warnings
+
+import numpy as np
+
+from helpers import COLORSCALE, N_COLOR_BUCKETS, color_buckets, color_indices
+
+
+def test_color_buckets_equal_range():
+    #all plans of the colored set share one value, others lie above or below it
+    values = np.array([-5., 0., 0., 5.])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        buckets = color_buckets(values, 0., 0.)
+    assert buckets.tolist() == [0, 0, 0, N_COLOR_BUCKETS-1]
+
+def test_color_buckets_range():
+    buckets = color_buckets(np.array([0., 0.5, 1., 2.]), 0., 1.)
+    assert buckets.tolist() == [0, N_COLOR_BUCKETS // 2, N_COLOR_BUCKETS-1, N_COLOR_BUCKETS-1]
+
+def test_color_indices_equal_range():
+    values = np.array([-5., 0., 5.])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        indices = color_indices(values, 0., 0.)
+    assert indices.tolist() == [0, 0, len(COLORSCALE)-1]
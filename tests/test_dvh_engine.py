@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from GazeOptimizer.patient_functions.helpers import cumulative_dvh
+from GazeOptimizer.patient_functions.patient import Patient
+
+
+@pytest.mark.parametrize('dvh_edges', [None, 'roi', 'patient'])
+def test_dvh_engine_matches_cumulative_dvh(patient_file, dvh_edges):
+    patient = Patient(patient_id='SYN', h5_file_path=patient_file, dvh_edges=dvh_edges)
+    store, engine = patient.dose_store, patient.dvh_engine
+    doses = store.doses
+    dvh_dose, dvh_volume = engine.compute(doses)
+    assert dvh_volume.shape == (len(doses), len(patient.roi_names), patient.num_dvh_bins)
+
+    max_dose = None if dvh_edges is None else np.broadcast_to(engine.max_dose, (len(patient.roi_names),))
+    for i, dose in enumerate(doses):
+        for j, roi in enumerate(patient.roi_names):
+            expected_dose, expected_volume = cumulative_dvh(
+                dose[store.roi_masks[roi]],
+                store.roi_relative_values[roi],
+                patient.voxel_vol,
+                bins=patient.num_dvh_bins,
+                dmax=None if max_dose is None else max_dose[j]
+            )
+            assert np.allclose(dvh_dose[i, j], expected_dose, rtol=0, atol=1e-10)
+            assert np.allclose(dvh_volume[i, j], expected_volume, rtol=0, atol=1e-10)
+
+def test_dvh_engine_rejects_full_grid_doses(patient):
+    with pytest.raises(ValueError):
+        patient.dvh_engine.compute(np.zeros((1, patient.dose_store.n_voxels + 1)))
@@ -0,0 +1,36 @@
+import numpy as np
+
+from GazeOptimizer.patient_functions.plan_cache import load_plan_cache
+from GazeOptimizer.patient_functions.precompute import precompute_plan_set
+
+
+def test_plan_cache_round_trip(patient, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    plan_set, _ = precompute_plan_set(patient, n_steps=5, cache_dir=cache_dir, verbose=False)
+    loaded = load_plan_cache(patient, n_steps=5, cache_dir=cache_dir)
+
+    #plans are only built on access
+    assert len(loaded) == len(plan_set)
+    assert len(loaded.plans.plans) == 0
+
+    for old, new in zip(plan_set.beams(), loaded.beams()):
+        assert np.array_equal(old, new, equal_nan=True)
+    for roi in plan_set.roi_names:
+        assert np.array_equal(plan_set.dose[roi], loaded.dose[roi])
+        assert np.array_equal(plan_set.volumes[roi], loaded.volumes[roi])
+        assert np.allclose(plan_set.auc(roi), loaded.auc(roi), rtol=0, atol=1e-9)
+    assert np.allclose(patient.cost_model.evaluate(plan_set)[0], patient.cost_model.evaluate(loaded)[0], rtol=0, atol=1e-9)
+
+    for plan_id in [0, len(plan_set) // 2, len(plan_set) - 1]:
+        old, new = plan_set[plan_id], loaded[plan_id]
+        assert new.name == old.name
+        assert new.angle_keys == old.angle_keys
+        assert np.array_equal(new.beam_weights, old.beam_weights)
+        for roi in plan_set.roi_names:
+            assert np.array_equal(new.dvhs[roi].volume, old.dvhs[roi].volume)
+    assert len(loaded.plans.plans) == 3
+
+def test_plan_cache_misses_other_inputs(patient, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    precompute_plan_set(patient, n_steps=5, cache_dir=cache_dir, verbose=False)
+    assert load_plan_cache(patient, n_steps=4, cache_dir=cache_dir) is None
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from GazeOptimizer.patient_functions.patient import Patient
+from GazeOptimizer.patient_functions.precompute import precompute_plan_set
+
+
+@pytest.mark.parametrize('dvh_edges', [None, 'roi'])
+def test_parallel_precompute_matches_serial(patient_file, tmp_path, dvh_edges):
+    plan_sets = [
+        precompute_plan_set(
+            Patient(patient_id='SYN', h5_file_path=patient_file, dvh_edges=dvh_edges),
+            n_steps=5,
+            cache_dir=str(tmp_path / f'workers{workers}'),
+            workers=workers,
+            verbose=False
+        )[0]
+        for workers in [1, 2]
+    ]
+    serial, parallel = plan_sets
+    assert [plan.name for plan in serial] == [plan.name for plan in parallel]
+    for roi in serial.roi_names:
+        assert np.array_equal(serial.dose[roi], parallel.dose[roi])
+        assert np.array_equal(serial.volumes[roi], parallel.volumes[roi])
@@ -0,0 +1,23 @@
+from itertools import combinations
+
+import numpy as np
+
+from GazeOptimizer.patient_functions.patient import find_best_beam_weight
+from GazeOptimizer.patient_functions.weight_search import golden_section_search, grid_brackets
+
+
+def test_golden_section_search_finds_unimodal_minimum():
+    x, fx, n_evals = golden_section_search(lambda x: (x - 0.3)**2, 0., 1., tol=1e-6)
+    assert abs(x - 0.3) < 1e-6
+    assert n_evals < 40
+
+def test_grid_brackets_lowest_local_minima_first():
+    xs = np.linspace(0, 1, 7)
+    fs = np.array([3., 1., 2., 4., 0., 5., 6.])
+    assert grid_brackets(xs, fs, n_brackets=2) == [(xs[3], xs[5]), (xs[0], xs[2])]
+
+def test_golden_never_worse_than_its_grid(patient):
+    for angle_key_1, angle_key_2 in list(combinations(patient.gaze_angle_keys, 2))[:5]:
+        _, grid_cost, _ = find_best_beam_weight(patient, angle_key_1, angle_key_2, n_steps=10)
+        _, golden_cost, _ = find_best_beam_weight(patient, angle_key_1, angle_key_2, n_steps=10, method='golden')
+        assert golden_cost <= grid_cost